@@ -0,0 +1,62 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cross talk plugin tests.
+"""
+
+from test import FlaskTestCase
+from victims.web.models import CVE, GroupState, Hash
+from victims.web.plugin.crosstalk import IndexPageMonitor
+
+
+class TestIndexPageMonitor(FlaskTestCase):
+    """
+    Tests for the cached front page statistics.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        self.monitor = IndexPageMonitor()
+        self.entry = Hash(
+            group='python', status='RELEASED', name='monitored',
+            cves=[CVE(id='CVE-1969-0001')],
+            hashes={'sha512': {'combined': 'AB'}})
+
+    def tearDown(self):
+        if self.entry.pk is not None:
+            self.entry.delete()
+
+    def test_revalidate(self):
+        data = self.monitor.get_data()
+        assert 'python' in data['groups']
+        before = data['stats']['python']['hashes']
+        version = self.monitor.version
+
+        # served as cached until revalidated
+        self.entry.save()
+        assert self.monitor.get_data() is data
+        assert GroupState.stamp() != version
+
+        self.monitor.revalidate()
+        assert self.monitor.version == GroupState.stamp()
+        assert self.monitor.get_data()['stats']['python']['hashes'] == \
+            before + 1
+
+    def test_unchanged(self):
+        data = self.monitor.get_data()
+        self.monitor.revalidate()
+        assert self.monitor.get_data() is data
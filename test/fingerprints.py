@@ -0,0 +1,104 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Fingerprint filter tests.
+"""
+
+import unittest
+from datetime import datetime
+from hashlib import sha1
+
+from test import FlaskTestCase
+from victims.web.fingerprints import BloomFilter, FingerprintFilter
+from victims.web.models import Hash
+
+
+class TestBloomFilter(unittest.TestCase):
+    """
+    Tests for the bloom filter.
+    """
+
+    def test_membership(self):
+        bloom = BloomFilter(1000, 0.01)
+        values = [sha1(str(i)).hexdigest() for i in range(1000)]
+        for value in values:
+            bloom.add(value)
+
+        # there are never false negatives
+        for value in values:
+            assert value in bloom
+
+        others = [sha1('x%d' % (i)).hexdigest() for i in range(10000)]
+        false_positives = len([value for value in others if value in bloom])
+        assert false_positives < 10000 * 0.02
+        assert bloom.false_positive_rate < 0.02
+
+    def test_unloaded_filter(self):
+        fingerprints = FingerprintFilter(['sha1'])
+        fingerprints.checked = float('inf')
+        assert fingerprints.might_contain('sha1', '0' * 40)
+        assert fingerprints.metrics()['loaded'] is False
+
+    def test_loaded_filter(self):
+        fingerprints = FingerprintFilter(['sha1'])
+        fingerprints.checked = float('inf')
+        fingerprints.filters = {'sha1': BloomFilter(10, 0.001)}
+        fingerprints.filters['sha1'].add('a' * 40)
+        assert fingerprints.might_contain('sha1', u'a' * 40)
+        assert not fingerprints.might_contain('sha1', 'b' * 40)
+        # unknown algorithms can not be ruled out
+        assert fingerprints.might_contain('md5', 'b' * 32)
+        metrics = fingerprints.metrics()
+        assert metrics['negatives'] == 1
+        assert metrics['filters']['sha1']['entries'] == 1
+
+
+class TestFingerprintFilter(FlaskTestCase):
+    """
+    Tests for loading the fingerprint filter from the database.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        self.collection = Hash._get_collection()
+        self.ids = []
+
+    def tearDown(self):
+        self.collection.remove({'_id': {'$in': self.ids}})
+
+    def insert(self, fingerprint, **fields):
+        fields['hashes'] = {'sha1': {'combined': fingerprint}}
+        self.ids.append(self.collection.insert(fields))
+
+    def test_build_and_revalidate(self):
+        self.insert('c' * 40, group='java', date=datetime.utcnow())
+        # hashes outside of the configured groups are looked up all the same
+        self.insert('d' * 40, group='legacy', date=datetime.utcnow())
+        self.insert('e' * 40, date=datetime.utcnow())
+
+        fingerprints = FingerprintFilter(['sha1'])
+        fingerprints.checked = float('inf')
+        fingerprints.revalidate()
+        assert fingerprints.builds == 1
+        for fingerprint in ['c' * 40, 'd' * 40, 'e' * 40]:
+            assert fingerprints.might_contain('sha1', fingerprint)
+
+        self.insert('f' * 40, group='legacy', date=datetime.utcnow())
+        fingerprints.revalidate()
+        # added incrementally rather than rebuilt
+        assert fingerprints.builds == 1
+        assert fingerprints.might_contain('sha1', 'f' * 40)
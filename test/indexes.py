@@ -0,0 +1,47 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Database index tests.
+"""
+
+from test import FlaskTestCase
+from victims.web.indexes import ensure_indexes, index_report
+from victims.web.models import Hash, MODELS
+
+
+class TestIndexes(FlaskTestCase):
+    """
+    Tests for the declared indexes.
+    """
+
+    def test_ensure_indexes(self):
+        reports = ensure_indexes()
+        assert len(reports) == len(MODELS)
+        for report in reports.values():
+            assert report['missing'] == []
+
+    def test_hash_lookups_indexed(self):
+        ensure_indexes([Hash])
+        report = index_report(Hash)
+        assert report['missing'] == []
+        collection = Hash._get_collection()
+        names = [
+            [field for (field, _) in info['key']]
+            for info in collection.index_information().values()
+        ]
+        assert ['hashes.sha512.combined'] in names
+        assert ['group', 'date', '_id'] in names
@@ -0,0 +1,117 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Job queue tests.
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from test import FlaskTestCase
+from victims.web import config
+from victims.web.handlers.queue import Worker, backoff, enqueue
+from victims.web.handlers.task import task
+from victims.web.models import Job
+
+_CALLS = []
+
+
+@task
+def record(value, fail=False):
+    _CALLS.append(value)
+    if fail:
+        raise ValueError('Failing as requested')
+
+
+class TestJobQueue(FlaskTestCase):
+    """
+    Tests for the durable job queue.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        Job.objects.delete()
+        del _CALLS[:]
+        self.backend = config.TASK_BACKEND
+        config.TASK_BACKEND = 'queue'
+
+    def tearDown(self):
+        config.TASK_BACKEND = self.backend
+        Job.objects.delete()
+
+    def test_enqueue_and_run(self):
+        record('a')
+        record('a')
+        record('b')
+        # identical queued jobs are only queued once
+        assert Job.objects(status='QUEUED').count() == 2
+
+        worker = Worker()
+        while worker.run_once():
+            pass
+        assert sorted(_CALLS) == ['a', 'b']
+        assert Job.objects(status='DONE').count() == 2
+        assert not worker.run_once()
+
+    def test_enqueue_deduplicated(self):
+        enqueue(record.task_name, 'e', fail=False)
+        enqueue(record.task_name, 'e', fail=False)
+        assert Job.objects.count() == 1
+
+        # the key is unique, should enqueues race
+        job = Job._get_collection().find_one()
+        duplicate = dict(job)
+        del duplicate['_id']
+        try:
+            Job._get_collection().insert(duplicate)
+            assert False
+        except DuplicateKeyError:
+            pass
+
+        # queued again once the job has started
+        assert Worker().claim() is not None
+        enqueue(record.task_name, 'e', fail=False)
+        assert Job.objects(status='QUEUED').count() == 1
+        assert Job.objects.count() == 2
+
+    def test_retry_with_backoff(self):
+        enqueue(record.task_name, 'c', fail=True)
+        worker = Worker()
+        assert worker.run_once()
+        job = Job.objects.first()
+        assert job.status == 'QUEUED'
+        assert job.attempts == 1
+        assert job.available > datetime.utcnow()
+        assert 'Failing as requested' in job.error
+        # not available again before the backoff
+        assert not worker.run_once()
+        assert backoff(2) == 2 * backoff(1)
+
+    def test_expired_lease(self):
+        enqueue(record.task_name, 'd')
+        worker = Worker()
+        job = worker.claim()
+        assert job['status'] == 'RUNNING'
+        assert worker.claim() is None
+
+        # the lease of a dead worker expires
+        Job.objects(id=job['_id']).update_one(
+            set__lease=datetime.utcnow() - timedelta(seconds=1))
+        assert Worker().run_once()
+        assert _CALLS == ['d']
+        assert Job.objects.first().status == 'DONE'
@@ -0,0 +1,60 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Search keyword tests.
+"""
+
+import unittest
+
+from victims.web.keywords import keywords, terms
+
+
+class TestKeywords(unittest.TestCase):
+    """
+    Tests for the search keywords of values and queries.
+    """
+
+    def test_keywords(self):
+        found = keywords(['Commons-IO', None, 'CVE-2013-0001'])
+        for keyword in [
+                'co', 'commons', 'commons-io', 'io', 'cve-2013', '2013',
+                '0001']:
+            assert keyword in found
+        assert 'c' not in found and 'ons' not in found
+        assert found == sorted(set(found))
+
+    def test_long_values(self):
+        value = 'x' * 100
+        assert max(len(keyword) for keyword in keywords([value])) == 32
+        assert keywords([value])[-1] in terms(value)
+
+        # tokens past the keyword length are still indexed
+        found = keywords(['spring-security-oauth2-autoconfigure'])
+        assert 'autoconfigure' in found
+        assert 'spring-security-oauth2-autoconfi' in found
+        found = keywords(['org.springframework.security.oauth.boot'])
+        assert 'boot' in found
+        assert max(len(keyword) for keyword in found) == 32
+
+    def test_terms(self):
+        assert terms(' Commons  io commons x ') == ['commons', 'io']
+        assert terms('') == []
+        # every term of a value is one of its keywords
+        value = 'org.apache.commons'
+        found = keywords([value])
+        for term in terms('org.apache APACHE comm'):
+            assert term in found
@@ -0,0 +1,154 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Model serialization and statistics tests.
+"""
+
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from test import FlaskTestCase
+from victims.web.models import (
+    CVE, Hash, GroupState, recount, statistics
+)
+
+
+class TestSerializers(unittest.TestCase):
+    """
+    Tests for the compiled model serializers.
+    """
+
+    def test_serializer_cached(self):
+        assert Hash.serializer(['cves', 'metadata']) is \
+            Hash.serializer(['metadata', 'cves '])
+        assert Hash.serializer() is not Hash.serializer(['cves'])
+
+    def test_reference_fields(self):
+        # no DBRefs to look for when streaming hashes
+        assert Hash.reference_fields() == []
+
+    def test_serialize_son(self):
+        data = {
+            '_id': 1, '_v1': {}, 'meta': [], 'hash': 'AB', 'unknown': 1,
+            'cves': [{'id': 'CVE-1969-0001'}],
+        }
+        result = Hash.serialize_son(data, ['cves', 'metadata'])
+        assert result == {'meta': [], 'cves': ['CVE-1969-0001']}
+        # nested fields select the top-level field
+        assert Hash.serialize_son(data, ['hashes.sha512']) == {}
+        result = Hash.serialize_son(data)
+        assert '_id' not in result and '_v1' not in result
+        assert result['hash'] == 'AB'
+
+    def test_jsonify(self):
+        entry = Hash(hash='AB', cves=[CVE(id='CVE-1969-0001')])
+        result = json.loads(entry.jsonify(['cves', 'hash']))
+        assert result == {'hash': 'AB', 'cves': ['CVE-1969-0001']}
+
+    def test_render_feed(self):
+        entry = Hash(
+            hash='AB', cves=[CVE(id='CVE-1969-0001')],
+            hashes={'sha512': {'combined': 'CD'}, 'md5': {'combined': 'EF'}})
+        entry.render_feed()
+        result = json.loads(entry._feed['json'])
+        # nested fields are projected like the database would
+        assert result['hashes'] == {'sha512': {'combined': 'CD'}}
+        assert result['cves'] == ['CVE-1969-0001']
+        assert 'group' not in result
+
+
+class TestStatistics(FlaskTestCase):
+    """
+    Tests for the per group counts of hashes and submissions.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        recount()
+        self.entry = Hash(
+            group='python', status='SUBMITTED', name='counted',
+            cves=[CVE(id='CVE-1969-0001')],
+            hashes={'sha512': {'combined': 'AB'}})
+
+    def tearDown(self):
+        if self.entry.pk is not None:
+            self.entry.delete()
+
+    def _hashes(self):
+        return GroupState.objects.get(group='python').counts['hashes']
+
+    def test_counts_maintained(self):
+        before = self._hashes()
+        self.entry.save()
+        assert self._hashes() == before
+        self.entry.status = 'RELEASED'
+        self.entry.save()
+        assert self._hashes() == before + 1
+        # saving again does not count the hash twice
+        self.entry.save()
+        assert self._hashes() == before + 1
+        assert statistics()['python']['hashes'] == before + 1
+        self.entry.delete()
+        self.entry.id = None
+        assert self._hashes() == before
+
+    def test_counts_moved_once(self):
+        before = self._hashes()
+        self.entry.status = 'RELEASED'
+        self.entry.save()
+        # a concurrent save of the same state finds it already counted
+        self.entry.move_counter(self.entry.counter())
+        assert self._hashes() == before + 1
+        # as does a concurrent delete finding it already uncounted
+        self.entry.move_counter(None)
+        self.entry.move_counter(None)
+        assert self._hashes() == before
+
+    def test_recount(self):
+        self.entry.status = 'RELEASED'
+        self.entry.save()
+        expected = statistics()
+        GroupState.objects(group='python').update_one(set__counts={})
+        assert recount() == expected
+        assert statistics() == expected
+
+
+class TestGroupState(FlaskTestCase):
+    """
+    Tests for the shared per group watermarks.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        GroupState.objects(group='testing').delete()
+
+    def tearDown(self):
+        GroupState.objects(group='testing').delete()
+
+    def test_mark_advances(self):
+        later = datetime(2014, 1, 2)
+        earlier = datetime(2014, 1, 1)
+        GroupState.mark('testing', updated=later)
+        assert GroupState.objects.get(group='testing').updated == later
+        GroupState.mark('testing', updated=earlier, removed=earlier)
+        state = GroupState.objects.get(group='testing')
+        assert state.updated == later
+        assert state.removed == earlier
+        GroupState.mark('testing', updated=later + timedelta(days=1))
+        state = GroupState.objects.get(group='testing')
+        assert state.updated == later + timedelta(days=1)
@@ -0,0 +1,86 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Plugin configuration tests.
+"""
+
+from test import FlaskTestCase
+from victims.web import config
+from victims.web.models import Plugin
+from victims.web.plugin import PluginConfig
+
+
+class TestPluginConfig(FlaskTestCase):
+    """
+    Tests for the cached and batched plugin configuration.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        self.check = config.PLUGIN_CONFIG_CHECK
+        self.config = PluginConfig('testing')
+        self.config.clear()
+
+    def tearDown(self):
+        config.PLUGIN_CONFIG_CHECK = self.check
+        self.config.delete()
+
+    def _stored(self):
+        return Plugin.objects.get(plugin='testing')
+
+    def test_set(self):
+        self.config.first = 1
+        assert self.config.first == 1
+        assert self._stored().get('first') == 1
+        assert self.config.missing is None
+
+    def test_batch(self):
+        version = self._stored().version
+        with self.config.batch():
+            self.config.first = 1
+            self.config.second = 2
+            # visible before being written
+            assert self.config.first == 1
+            assert self._stored().get('first') is None
+        stored = self._stored()
+        assert stored.version == version + 1
+        assert stored.get('first') == 1 and stored.get('second') == 2
+
+    def test_batch_discarded(self):
+        try:
+            with self.config.batch():
+                self.config.first = 1
+                raise ValueError()
+        except ValueError:
+            pass
+        assert self.config.first is None
+        assert self._stored().get('first') is None
+
+    def test_changed_elsewhere(self):
+        config.PLUGIN_CONFIG_CHECK = 60
+        self.config.first = 1
+        PluginConfig('testing').first = 2
+        # served from memory until checked
+        assert self.config.first == 1
+        config.PLUGIN_CONFIG_CHECK = 0
+        assert self.config.first == 2
+
+    def test_pop(self):
+        self.config.first = 1
+        self.config.pop('first')
+        assert self.config.first is None
+        assert 'first' not in self._stored().config
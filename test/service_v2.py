@@ -19,9 +19,12 @@ Service version 2 testing.
 """
 
 import json
+import zlib
 from StringIO import StringIO
 from base64 import b64encode
-from datetime import datetime
+from bson.dbref import DBRef
+from datetime import datetime, timedelta
+from gzip import GzipFile
 from hashlib import md5
 from shutil import rmtree
 
@@ -29,9 +32,18 @@ from os import listdir
 from os.path import isdir
 
 from test import UserTestCase
+from victims.web import application
+from victims.web.blueprints import service_v2
+from victims.web.blueprints.service_v2 import msgpack
+from victims.web.cache import cache
 from victims.web.config import DEFAULT_GROUP, UPLOAD_FOLDER, VICTIMS_API_HEADER
 from victims.web.handlers.security import generate_signature
-from victims.web.models import Removal, Submission
+from victims.web.indexes import reindex_keywords, reindex_versions
+from victims.web.models import (
+    GroupState, Removal, Submission, collect_dbrefs, forget_username,
+    handle_special_objs, prefetch_dbrefs, resolve_usernames
+)
+from victims.web.snapshots import generate
 
 
 class TestServiceV2(UserTestCase):
@@ -141,6 +153,102 @@ class TestServiceV2(UserTestCase):
         }
         self.verify_data_structure(result, expected, True)
 
+    def test_paginated_updates(self):
+        """
+        Ensures pages can be resumed using the continuation token.
+        """
+        base = '/service/v2/update/java/1970-01-01T00:00:00/'
+        resp = self.app.get('%s?limit=1' % (base))
+        assert resp.status_code == 200
+        first = json.loads(resp.data)
+        assert len(first) == 1
+
+        cursor = resp.headers.get('X-Victims-Cursor')
+        assert cursor is not None
+        resp = self.app.get('%s?limit=1&cursor=%s' % (base, cursor))
+        assert resp.status_code == 200
+        assert first[0] not in json.loads(resp.data)
+
+        for args in ['limit=0', 'limit=NotAnInt', 'cursor=invalid']:
+            resp = self.app.get('%s?%s' % (base, args))
+            assert resp.status_code == 400
+
+    def test_negotiated_updates(self):
+        """
+        Ensures updates can be streamed as newline delimited json and
+        MessagePack records.
+        """
+        route = '/service/v2/update/java/1970-01-01T00:00:00/'
+        resp = self.app.get(route, headers={'Accept': 'application/x-ndjson'})
+        assert resp.status_code == 200
+        assert resp.content_type == 'application/x-ndjson'
+        records = [json.loads(line) for line in resp.data.splitlines()]
+        expected = json.loads(self.app.get(route).data)
+        assert records == [item['fields'] for item in expected]
+
+        if msgpack is None:
+            return
+
+        resp = self.app.get(route, headers={'Accept': 'application/msgpack'})
+        assert resp.status_code == 200
+        assert resp.content_type == 'application/msgpack'
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(resp.data)
+        assert len(list(unpacker)) == len(records)
+
+    def test_conditional_feeds(self):
+        """
+        Ensures unchanged feeds are answered with a 304.
+        """
+        for kind in self.points:
+            route = '/service/v2/%s/java/1970-01-01T00:00:00/' % (kind)
+            resp = self.app.get(route)
+            assert resp.status_code == 200
+            etag = resp.headers.get('ETag')
+            assert etag is not None
+
+            resp = self.app.get(route, headers={'If-None-Match': etag})
+            assert resp.status_code == 304
+            assert len(resp.data) == 0
+
+            resp = self.app.get(route, headers={'If-None-Match': '"stale"'})
+            assert resp.status_code == 200
+
+    def test_compressed_feeds(self):
+        """
+        Ensures feeds are compressed when the client accepts it.
+        """
+        for kind in self.points:
+            route = '/service/v2/%s/java/1970-01-01T00:00:00/' % (kind)
+            expected = self.app.get(route).data
+            for (encoding, wbits) in [('gzip', 31), ('deflate', 15)]:
+                resp = self.app.get(
+                    route, headers={'Accept-Encoding': encoding})
+                assert resp.status_code == 200
+                assert resp.headers.get('Content-Encoding') == encoding
+                assert zlib.decompress(resp.data, wbits) == expected
+
+    def test_snapshot(self):
+        """
+        Ensures the snapshot of a group can be downloaded and revalidated.
+        """
+        generate(DEFAULT_GROUP)
+        resp = self.app.get('/service/v2/snapshot/%s/' % (DEFAULT_GROUP))
+        assert resp.status_code == 200
+        assert resp.content_type == 'application/gzip'
+        assert resp.headers.get('X-Victims-Snapshot-Date') is not None
+
+        lines = GzipFile(fileobj=StringIO(resp.data)).read().splitlines()
+        assert len(lines) > 0
+        for line in lines:
+            assert 'hashes' in json.loads(line)
+
+        resp = self.app.get(
+            '/service/v2/snapshot/%s/' % (DEFAULT_GROUP),
+            headers={'If-None-Match': resp.headers['ETag']}
+        )
+        assert resp.status_code == 304
+
     def test_cves_valid(self):
         """
         Ensure valid cve (hash) search works
@@ -172,6 +280,31 @@ class TestServiceV2(UserTestCase):
         assert isinstance(result, list)
         assert result[0]['error'].find('Invalid checksum length for sha1') >= 0
 
+    def test_cves_batch(self):
+        """
+        Ensure fingerprints can be looked up in a single request
+        """
+        sha512 = "a0a86214ea153fb07ff35ceec0848dd1703eae22de036a825efc8" + \
+            "394e50f65e3044832f3b49cf7e45a39edc470bdf738abc36a3a78c" + \
+            "a7df3a6e73c14eaef94a8"
+        data = {'sha512': [sha512, '0' * 128], 'md5': ['0' * 32]}
+        resp = self.app.post(
+            '/service/v2/cves/', data=json.dumps(data),
+            content_type='application/json')
+        assert resp.status_code == 200
+        result = json.loads(resp.data)
+        assert isinstance(result, list)
+        assert len(result) == 1
+        assert result[0]['fields']['fingerprint'] == sha512
+        assert result[0]['fields']['algorithm'] == 'sha512'
+        assert 'CVE-1969-0001' in result[0]['fields']['cves']
+
+        for data in [{}, {'invalid': []}, {'sha1': ['0']}, {'md5': 'x'}]:
+            resp = self.app.post(
+                '/service/v2/cves/', data=json.dumps(data),
+                content_type='application/json')
+            assert resp.status_code == 400
+
     def test_cves_coordinates_invalid(self):
         """
         Ensure invalid cve (coordinates) is caught
@@ -194,6 +327,105 @@ class TestServiceV2(UserTestCase):
             assert isinstance(result, list)
             assert 'CVE-1969-0001' in result[0]['fields']["cves"]
 
+    def test_cves_version_range(self):
+        """
+        Ensure cves can be looked up by version range
+        """
+        reindex_versions()
+        base = '/service/v2/cves/java/?groupId=fake&artifactId=jar'
+        for query in ['version_lt=1.1', 'version_ge=1.0-beta',
+                      'version_gt=0.9&version_le=1.0.0']:
+            resp = self.app.get('%s&%s' % (base, query))
+            assert resp.status_code == 200
+            result = json.loads(resp.data)
+            assert 'CVE-1969-0001' in result[0]['fields']["cves"]
+
+        for query in ['version_lt=1.0', 'version_gt=1.0-sp']:
+            resp = self.app.get('%s&%s' % (base, query))
+            assert resp.status_code == 200
+            assert json.loads(resp.data) == []
+
+    def test_feed_cached(self):
+        """
+        Ensure streamed feeds are cached once sent and served from the cache
+        """
+        app = application.app
+        cache_type = app.config['CACHE_TYPE']
+        streamed = service_v2.StreamedSerialResponseValue
+        app.config['CACHE_TYPE'] = 'simple'
+        cache.init_app(app)
+        try:
+            uri = '/service/v2/update/java/1970-01-01T00:00:00/'
+            resp = self.app.get(uri)
+            assert resp.status_code == 200
+            expected = resp.data
+
+            def uncached(*args, **kwargs):
+                raise AssertionError('Feed not served from the cache')
+
+            service_v2.StreamedSerialResponseValue = uncached
+            resp = self.app.get(uri)
+            assert resp.status_code == 200
+            assert resp.data == expected
+        finally:
+            service_v2.StreamedSerialResponseValue = streamed
+            app.config['CACHE_TYPE'] = cache_type
+            cache.init_app(app)
+
+    def test_search(self):
+        """
+        Ensure hashes can be searched by name, cve and coordinates
+        """
+        reindex_keywords()
+        base = '/service/v2/search/'
+        for query in ['fake-1.0', 'cve-1969', 'FAKE jar', '1969 fake']:
+            resp = self.app.get('%s?q=%s&groups=java' % (base, query))
+            assert resp.status_code == 200
+            result = json.loads(resp.data)
+            assert len(result) > 0
+            assert 'CVE-1969-0001' in result[0]['fields']['cves']
+
+        for query in ['q=notfake', 'q=fake&groups=python']:
+            resp = self.app.get('%s?%s' % (base, query))
+            assert resp.status_code == 200
+            assert json.loads(resp.data) == []
+
+        for query in ['', 'q=', 'q=fake&limit=0', 'q=fake&cursor=invalid']:
+            resp = self.app.get('%s?%s' % (base, query))
+            assert resp.status_code == 400
+
+    def test_cves_coordinates_batch(self):
+        """
+        Ensure a list of coordinates can be looked up in a single request
+        """
+        base = '/service/v2/cves/java/'
+        data = [
+            'notfake:notfake:1.0',
+            {'groupId': 'fake', 'version': '1.0'},
+            'fake',
+        ]
+        resp = self.app.post(
+            base, data=json.dumps(data), content_type='application/json')
+        assert resp.status_code == 200
+        result = json.loads(resp.data)
+        assert isinstance(result, list)
+        indexes = [item['fields']['index'] for item in result]
+        assert 0 not in indexes
+        assert 1 in indexes
+        assert 2 in indexes
+        for item in result:
+            assert 'CVE-1969-0001' in item['fields']['cves']
+
+        for data in [[], [{}], ['a:b:c:d'], [1], {'groupId': 'fake'}]:
+            resp = self.app.post(
+                base, data=json.dumps(data), content_type='application/json')
+            assert resp.status_code == 400
+
+        resp = self.app.post(
+            '/service/v2/cves/invalid/', data=json.dumps(['fake']),
+            content_type='application/json')
+        assert resp.status_code == 400
+
     def test_status(self):
         """
         Verifies the status data is correct.
@@ -208,6 +440,67 @@ class TestServiceV2(UserTestCase):
         assert result['supported'] is True
         assert result['endpoint'] == '/service/v2/'
 
+    def test_dbref_resolution(self):
+        """
+        Ensure account references are resolved in batches and cached
+        """
+        ref = DBRef('users', self.account.id)
+        items = [{'submitter': ref}, {'nested': [{'submitter': ref}]}]
+        assert collect_dbrefs(items) == set([self.account.id])
+
+        forget_username(self.account.id)
+        prefetch_dbrefs(items)
+        usernames = resolve_usernames([self.account.id])
+        assert usernames[self.account.id] == self.username
+        assert json.dumps(items[0], default=handle_special_objs) == \
+            json.dumps({'submitter': self.username})
+
+    def test_removals_compaction(self):
+        """
+        Ensure removals are collapsed and expired, moving the group horizon.
+        """
+        # compaction runs over all removals, restore those of other tests
+        collection = Removal._get_collection()
+        others = list(collection.find())
+        horizons = dict(
+            (state.group, state.horizon) for state in GroupState.objects)
+        now = datetime.utcnow()
+        Removal(
+            hash='EEE111', group=DEFAULT_GROUP,
+            date=now - timedelta(days=800)).save()
+        for days in [3, 2, 1]:
+            Removal(
+                hash='DEF456', group=DEFAULT_GROUP, reason='UPDATE',
+                date=now - timedelta(days=days)).save()
+
+        try:
+            (collapsed, expired) = Removal.compact(timedelta(days=365))
+            assert collapsed >= 2
+            assert expired >= 1
+            assert Removal.objects(hash='DEF456').count() == 1
+            assert Removal.objects(hash='EEE111').count() == 0
+
+            resp = self.app.get(
+                '/service/v2/remove/%s/1970-01-01T00:00:00/' % DEFAULT_GROUP)
+            assert resp.status_code == 410
+            assert json.loads(resp.data)[0]['resync'] is True
+
+            since = (now - timedelta(days=5)).strftime('%Y-%m-%dT%H:%M:%S')
+            resp = self.app.get(
+                '/service/v2/remove/%s/%s/' % (DEFAULT_GROUP, since))
+            assert resp.status_code == 200
+            assert 'DEF456' in resp.data
+        finally:
+            Removal.objects(hash__in=['DEF456', 'EEE111']).delete()
+            for item in others:
+                collection.save(item)
+            for state in GroupState.objects:
+                horizon = horizons.get(state.group)
+                if horizon is None:
+                    state.update(unset__horizon=True)
+                else:
+                    state.update(set__horizon=horizon)
+
     def test_removals(self):
         test_hash = 'ABC123'
         removal = Removal()
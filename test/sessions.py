@@ -0,0 +1,53 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Session storage tests.
+"""
+
+from test import FlaskTestCase
+from victims.web import application
+
+
+class TestSessions(FlaskTestCase):
+    """
+    Tests for the database expiry of sessions.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        self.interface = application.app.session_interface
+        self.collection = self.interface.cls._get_collection()
+
+    def _expiry(self):
+        for info in self.collection.index_information().values():
+            if info['key'] == [('expiration', 1)]:
+                return info.get('expireAfterSeconds')
+
+    def test_ttl_index(self):
+        self.interface.ensure_expiry()
+        assert self._expiry() == 0
+
+    def test_ttl_index_modified(self):
+        self.collection.database.command(
+            'collMod', self.collection.name,
+            index={
+                'keyPattern': {'expiration': 1},
+                'expireAfterSeconds': 3600
+            })
+        assert self._expiry() == 3600
+        self.interface.ensure_expiry()
+        assert self._expiry() == 0
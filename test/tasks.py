@@ -0,0 +1,90 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Task manager tests.
+"""
+
+import unittest
+from threading import Event
+from time import sleep
+
+from flask import has_app_context
+
+from victims.web.handlers.task import TaskManager
+
+
+class TestTaskManager(unittest.TestCase):
+    """
+    Tests for the bounded task manager.
+    """
+
+    def setUp(self):
+        self.release = Event()
+        self.started = Event()
+        self.calls = []
+
+    def tearDown(self):
+        self.release.set()
+
+    def block(self):
+        self.started.set()
+        self.release.wait(5)
+
+    def record(self, value):
+        self.calls.append(value)
+
+    def test_dedup_and_drop(self):
+        taskman = TaskManager(workers=1, limit=2, policy='drop')
+        assert taskman.add_task(self.block)
+        self.started.wait(5)
+        assert taskman.counters['running'] == 1
+
+        assert taskman.add_task(self.record, 'a')
+        # identical pending tasks collapse into one
+        assert not taskman.add_task(self.record, 'a')
+        assert taskman.add_task(self.record, 'b')
+        # the queue is full
+        assert not taskman.add_task(self.record, 'c')
+        assert taskman.counters['queued'] == 2
+        assert taskman.counters['deduplicated'] == 1
+        assert taskman.counters['dropped'] == 1
+
+        self.release.set()
+        for _ in range(50):
+            if taskman.counters['completed'] == 3:
+                break
+            sleep(0.1)
+        assert sorted(self.calls) == ['a', 'b']
+        assert taskman.counters['queued'] == 0
+
+    def test_caller_policy(self):
+        taskman = TaskManager(workers=1, limit=1, policy='caller')
+        taskman.add_task(self.block)
+        self.started.wait(5)
+        taskman.add_task(self.record, 'a')
+        # run by the caller as the queue is full
+        assert taskman.add_task(self.record, 'b')
+        assert self.calls == ['b']
+
+    def test_app_context(self):
+        taskman = TaskManager(workers=1, limit=1, policy='drop')
+        assert taskman.add_task(lambda: self.record(has_app_context()))
+        for _ in range(50):
+            if taskman.counters['completed'] == 1:
+                break
+            sleep(0.1)
+        assert self.calls == [True]
@@ -0,0 +1,123 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Web ui tests.
+"""
+
+from test import FlaskTestCase
+from victims.web import application
+from victims.web.blueprints.ui import hashes_page
+from victims.web.cache import cache
+from victims.web.models import CVE, Hash
+
+
+class TestHashesBrowser(FlaskTestCase):
+    """
+    Tests for the paginated hashes listing.
+    """
+
+    def setUp(self):
+        FlaskTestCase.setUp(self)
+        self.entries = []
+        for (group, name) in [
+                ('python', 'browse-b'), ('python', 'browse-a'),
+                ('ruby', 'browse-c'), ('ruby', 'browse-b')]:
+            entry = Hash(
+                group=group, status='RELEASED', name=name, version='1.0',
+                cves=[CVE(id='CVE-1969-0001')],
+                hashes={'sha512': {'combined': 'AB'}})
+            entry.save()
+            self.entries.append(entry)
+
+    def tearDown(self):
+        for entry in self.entries:
+            entry.delete()
+
+    def _walk(self, groups, sort):
+        seen = []
+        cursor = None
+        while True:
+            (rows, cursor) = hashes_page(groups, sort, cursor, limit=3)
+            seen.extend(rows)
+            if cursor is None:
+                return seen
+
+    def test_pages(self):
+        ids = set(str(entry.id) for entry in self.entries)
+        for sort in ['name', 'date']:
+            rows = self._walk(['python', 'ruby'], sort)
+            found = [str(row['_id']) for row in rows]
+            # every hash is listed exactly once
+            assert len(found) == len(set(found))
+            assert ids <= set(found)
+
+        rows = self._walk(['python', 'ruby'], 'name')
+        names = [row.get('name') for row in rows]
+        assert names == sorted(names)
+
+        rows = self._walk(['python', 'ruby'], 'date')
+        dates = [row['date'] for row in rows]
+        assert dates == sorted(dates, reverse=True)
+
+    def test_group_filter(self):
+        rows = self._walk(['ruby'], 'name')
+        names = [row['name'] for row in rows if row['name'].startswith('b')]
+        assert names == ['browse-b', 'browse-c']
+
+    def test_invalid_cursor(self):
+        try:
+            hashes_page(['python'], 'name', 'invalid')
+            assert False
+        except ValueError:
+            pass
+
+    def test_search(self):
+        resp = self.app.get('/search/?q=browse-b')
+        assert resp.status_code == 200
+        assert 'browse-b' in resp.data and 'browse-a' not in resp.data
+        resp = self.app.get('/search/?q=browse')
+        assert 'browse-a' in resp.data and 'browse-c' in resp.data
+        resp = self.app.get('/search/')
+        assert resp.status_code == 200
+
+    def test_cached_pages(self):
+        app = application.app
+        cache_type = app.config['CACHE_TYPE']
+        app.config['CACHE_TYPE'] = 'simple'
+        cache.init_app(app)
+        try:
+            resp = self.app.get('/hashes/python/')
+            assert 'browse-a' in resp.data
+            # edits are shown although no count changed
+            self.entries[1].name = 'browse-renamed'
+            self.entries[1].save()
+            resp = self.app.get('/hashes/python/')
+            assert 'browse-renamed' in resp.data
+            assert 'browse-a-' not in resp.data
+        finally:
+            app.config['CACHE_TYPE'] = cache_type
+            cache.init_app(app)
+
+    def test_views(self):
+        resp = self.app.get('/hashes/')
+        assert resp.status_code == 200
+        assert 'browse-a' in resp.data
+        resp = self.app.get('/hashes/ruby/?sort=date')
+        assert resp.status_code == 200
+        assert 'browse-a' not in resp.data
+        resp = self.app.get('/hashes/?cursor=invalid')
+        assert resp.status_code == 302
@@ -0,0 +1,61 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Version ordering tests.
+"""
+
+import unittest
+
+from victims.web.versions import (
+    maven_key, pep440_key, rubygems_key, compare)
+
+
+class TestVersions(unittest.TestCase):
+    """
+    Tests for the sortable version keys.
+    """
+
+    def assert_ordered(self, scheme, versions):
+        keys = [scheme(version) for version in versions]
+        for (lower, higher) in zip(keys, keys[1:]):
+            assert lower < higher
+
+    def test_maven(self):
+        self.assert_ordered(maven_key, [
+            '1.0-alpha-1', '1.0-beta', '1.0-M1', '1.0-RC1', '1.0-SNAPSHOT',
+            '1.0', '1.0-sp', '1.0-foo', '1.0.1', '1.2', '1.10', '2'
+        ])
+        assert maven_key('1') == maven_key('1.0.0') == maven_key('1-GA')
+
+    def test_pep440(self):
+        self.assert_ordered(pep440_key, [
+            '1.0.dev1', '1.0a1.dev1', '1.0a1', '1.0b2', '1.0rc1', '1.0',
+            '1.0.post1.dev1', '1.0.post1', '1.0.1', '1.10', '1!0.1'
+        ])
+        assert pep440_key('1') == pep440_key('1.0+local')
+        self.assertRaises(ValueError, pep440_key, 'not a version')
+
+    def test_rubygems(self):
+        self.assert_ordered(rubygems_key, [
+            '1.0.a', '1.0.pre', '1.0', '1.0.1', '1.2', '1.10'
+        ])
+        assert rubygems_key('1') == rubygems_key('1.0')
+
+    def test_compare(self):
+        assert compare('java', '1.10', '1.9') == 1
+        assert compare('python', '1.0', '1.0.0') == 0
+        assert compare('ruby', '1.0.pre', '1.0') == -1
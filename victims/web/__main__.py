@@ -16,10 +16,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 The __main__ module for the victims.web package to allow it to be executable.
+
+Without a command the development server is started, use the serve command
+to run the production server.
 """
+import sys
+from argparse import ArgumentParser
 
 
-def main():
+def server(args):
     from victims.web.application import app
     app.run(
         host=app.config['FLASK_HOST'],
@@ -28,5 +33,100 @@ def main():
     )
 
 
+def serve(args):
+    from victims.web.server import serve
+    serve()
+
+
+def worker(args):
+    from victims.web.handlers.queue import run_workers
+    run_workers(args.concurrency)
+
+
+def ensure_indexes(args):
+    from victims.web.application import app
+    from victims.web.indexes import ensure_indexes
+
+    def keys(key):
+        return ', '.join('%s:%d' % field for field in key)
+
+    app.logger.info('Ensuring database indexes')
+    reports = ensure_indexes()
+
+    problems = 0
+    for collection in sorted(reports.keys()):
+        report = reports[collection]
+        for key in report['built']:
+            print('%s: building index (%s)' % (collection, keys(key)))
+        for key in report['missing']:
+            problems += 1
+            print('%s: missing index (%s)' % (collection, keys(key)))
+        for name in report['undeclared']:
+            print('%s: undeclared index %s' % (collection, name))
+        if report['unused'] is None:
+            print('%s: index usage statistics not available' % (collection))
+        else:
+            for name in report['unused']:
+                print('%s: unused index %s' % (collection, name))
+    return 1 if problems else 0
+
+
+def reindex(args):
+    from victims.web.application import app
+    from victims.web.indexes import (
+        reindex_versions, reindex_keywords, render_feeds
+    )
+
+    app.logger.info('Updating version keys, search keywords and feed json')
+    print('Updated the version keys of %d hashes' % (reindex_versions()))
+    print('Updated the search keywords of %d hashes' % (reindex_keywords()))
+    print('Rendered the feed json of %d hashes' % (render_feeds()))
+    return 0
+
+
+def compact_removals(args):
+    from victims.web.application import app
+    from victims.web.models import Removal
+
+    app.logger.info('Compacting removals')
+    (collapsed, expired) = Removal.compact()
+    print('Collapsed %d and expired %d removals' % (collapsed, expired))
+    return 0
+
+
+def recount(args):
+    from victims.web.application import app
+    from victims.web.models import recount
+
+    app.logger.info('Recounting statistics')
+    for (group, counts) in sorted(recount().items()):
+        print('%s: %s' % (group, ', '.join(
+            '%s %d' % count for count in sorted(counts.items()))))
+    return 0
+
+
+COMMANDS = {
+    'server': server,
+    'serve': serve,
+    'worker': worker,
+    'ensure-indexes': ensure_indexes,
+    'reindex': reindex,
+    'compact-removals': compact_removals,
+    'recount': recount,
+}
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='victims-web-server')
+    parser.add_argument(
+        'command', nargs='?', default='server', choices=sorted(COMMANDS),
+        help='the command to run (default: server)')
+    parser.add_argument(
+        '-c', '--concurrency', type=int, default=None,
+        help='number of concurrent workers (worker only)')
+    args = parser.parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -31,6 +31,8 @@ from flask_admin.contrib.mongoengine import ModelView
 from wtforms import fields, validators
 
 from victims.web.cache import cache
+from victims.web.fingerprints import fingerprint_filter
+from victims.web.handlers.task import taskman
 from victims.web.handlers.forms import GroupHashable, ValidateOnlyIf
 from victims.web.models import Account, Hash, Submission
 from victims.web.util import groups, set_hash
@@ -98,6 +100,20 @@ class CacheAdminView(SafeBaseView):
         return redirect(url_for('.index'))
 
 
+class MetricsAdminView(SafeBaseView):
+    """
+    Runtime metrics of this worker.
+    """
+
+    @expose('/')
+    def index(self):
+        return self.render(
+            'admin/metrics_index.html',
+            fingerprints=fingerprint_filter.metrics(),
+            tasks=taskman.counters
+        )
+
+
 class AccountView(SafeModelView):
     column_filters = ('username', )
     column_exclude_list = ('password', 'apikey', 'secret')
@@ -176,6 +192,8 @@ def administration_setup(app):
 
     # Application administration
     administration.add_view(CacheAdminView(name='Cache', endpoint='cache'))
+    administration.add_view(MetricsAdminView(
+        name='Metrics', endpoint='metrics'))
 
     # Database management
     administration.add_view(AccountView(
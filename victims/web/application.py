@@ -21,9 +21,9 @@ Module which results with a ready to use wsgi application.
 import logging.config
 
 import os
-from flask import Flask, render_template, session
+from flask import Flask, render_template
 from flask_bootstrap import Bootstrap
-from flask_mongoengine import MongoEngine, MongoEngineSessionInterface
+from flask_mongoengine import MongoEngine
 from flask_seasurf import SeaSurf
 from flask_reggie import Reggie
 
@@ -63,22 +63,26 @@ if app.debug and not app.testing:
         pass
 
 # mongodb and sessions
+from victims.web.handlers.sessions import VSessionInterface
+
 app.db = MongoEngine(app)
-app.session_interface = MongoEngineSessionInterface(app.db)
+app.session_interface = VSessionInterface(app.db)
+app.session_interface.ensure_expiry()
 
 # web setup
 # this happens after basic setup to facilitate database availability
 from victims.web.admin import administration_setup
 from victims.web.blueprints.service_v1 import v1
-from victims.web.blueprints.service_v2 import v2, SUBMISSION_ROUTES
+from victims.web.blueprints.service_v2 import (
+    v2, SUBMISSION_ROUTES, LOOKUP_ROUTES
+)
 from victims.web.blueprints.ui import ui
 from victims.web.blueprints.auth import auth
 
 from victims.web.cache import cache
+from victims.web.fingerprints import fingerprint_filter
 from victims.web.handlers.security import setup_security
 from victims.web.handlers.sslify import VSSLify
-from victims.web.handlers.task import taskman
-from victims.web.plugin.crosstalk import session_reaper
 
 # Custom SSLify
 sslify = VSSLify(app)
@@ -86,6 +90,9 @@ sslify = VSSLify(app)
 # cache
 cache.init_app(app)
 
+# fingerprint lookups
+fingerprint_filter.init_app(app)
+
 # admin setup
 administration_setup(app)
 
@@ -93,18 +100,14 @@ administration_setup(app)
 for submit in SUBMISSION_ROUTES:
     csrf.exempt(submit)
 
+for lookup in LOOKUP_ROUTES:
+    csrf.exempt(lookup)
+
 
 # SetUp identity management
 setup_security(app)
 
 
-@app.after_request
-def reap_sessions(response):
-    if session.modified:
-        taskman.add_task(session_reaper.reap)
-    return response
-
-
 @app.errorhandler(403)
 def error_403(e):
     return render_template(
@@ -20,17 +20,40 @@ application versions.
 """
 import datetime
 import json
+import zlib
+from functools import wraps
+from hashlib import sha1
 
-from flask import Blueprint, Response, request, current_app
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from flask import Blueprint, Response, request, current_app, send_file, g
+from mongoengine import Q
+from os.path import basename
 
 from victims.web.cache import cache
 from victims.web.config import \
-    DEFAULT_GROUP, SUBMISSION_GROUPS, API_UPDATES_DEFAULT_FIELDS
+    DEFAULT_GROUP, SUBMISSION_GROUPS, API_UPDATES_DEFAULT_FIELDS, \
+    API_UPDATES_PAGE_LIMIT, API_UPDATES_SINCE_BUCKET, \
+    API_FEED_CACHE_MAX_SIZE, API_FEED_COMPRESSION_LEVEL, API_FEED_BATCH_SIZE
 from victims.web.handlers.security import apiauth, api_request_user
 from victims.web.handlers.sslify import ssl_exclude
-from victims.web.models import Hash, Removal, JsonifyMixin, CoordinateDict
+from victims.web import snapshots
+from victims.web.fingerprints import fingerprint_filter
+from victims.web.models import (
+    Hash, Removal, GroupState, JsonifyMixin, CoordinateDict,
+    handle_special_objs, prefetch_dbrefs
+)
 from victims.web.submissions import submit, upload
-from victims.web.util import groups
+from victims.web.util import (
+    groups, encode_cursor, decode_cursor, to_millis, from_millis, search
+)
+from victims.web.versions import version_key
+
+try:
+    import msgpack
+except ImportError:
+    # MessagePack responses are only offered if msgpack is available
+    msgpack = None
 
 v2 = Blueprint('service_v2', __name__)
 
@@ -38,16 +61,48 @@ v2 = Blueprint('service_v2', __name__)
 # Module globals
 EOL = None
 MIME_TYPE = 'application/json'
-
-
-def make_response(data, code=200):
+NDJSON_MIME_TYPE = 'application/x-ndjson'
+MSGPACK_MIME_TYPE = 'application/msgpack'
+CURSOR_HEADER = 'X-Victims-Cursor'
+SNAPSHOT_HEADER = 'X-Victims-Snapshot-Date'
+SNAPSHOT_MIME_TYPE = 'application/gzip'
+# Fingerprinting algorithms available for lookups and their checksum lengths
+ALGORITHMS = ['sha512', 'sha1', 'md5']
+CHECKSUM_LENGTHS = {'sha512': 128, 'sha1': 40, 'md5': 32}
+# Arguments for version range lookups and their query operators
+VERSION_RANGE_ARGS = [
+    ('version_lt', 'lt'), ('version_le', 'lte'),
+    ('version_gt', 'gt'), ('version_ge', 'gte'),
+]
+
+
+def make_response(data, code=200, mimetype=MIME_TYPE):
     return Response(
         response=data,
         status=code,
-        mimetype=MIME_TYPE
+        mimetype=mimetype
     )
 
 
+def negotiate():
+    """
+    Returns the best mimetype for a streamed response as requested by the
+    client's Accept header. Defaults to MIME_TYPE.
+    """
+    offered = [MIME_TYPE, NDJSON_MIME_TYPE]
+    if msgpack is not None:
+        offered.append(MSGPACK_MIME_TYPE)
+    return request.accept_mimetypes.best_match(offered, MIME_TYPE)
+
+
+def negotiate_encoding():
+    """
+    Returns the content encoding ('gzip' or 'deflate') to compress a streamed
+    response with, None if the client accepts neither.
+    """
+    return request.accept_encodings.best_match(['gzip', 'deflate'])
+
+
 def error(msg='Could not understand request.', code=400, **kwargs):
     """
     Returns an error json response.
@@ -78,67 +133,272 @@ def invalid_call(path):
     return error('Invalid API call', 404, path=path)
 
 
+def stream_json_array(elements):
+    """
+    Generator writing the given json strings out as a json array.
+
+    Each separator is emitted along with the element that follows it, hence
+    the number of elements need not be known before streaming starts.
+
+    :Parameters:
+       - `elements`: An iterable of json strings.
+    """
+    yield "[\n"
+    separator = ""
+    for element in elements:
+        yield separator + element
+        separator = ",\n"
+    yield "]"
+
+
 class StreamedSerialResponseValue(object):
     """
     A thin wrapper class around the cleaned/filtered results to enable
     streaming and caching simultaneously.
+
+    Depending on the mimetype the results are streamed as a json array of
+    {"fields": ...} objects (MIME_TYPE), as newline delimited json records
+    (NDJSON_MIME_TYPE) or as a sequence of MessagePack encoded records
+    (MSGPACK_MIME_TYPE). The latter two can be parsed incrementally.
     """
 
-    def __init__(self, result, fields=None):
+    def __init__(self, result, fields=None, mimetype=MIME_TYPE):
         """
         Creates the streamed iterator.
 
         :Parameters:
            - `result`: The result to iterate over.
+           - `fields`: The fields to include for each item.
+           - `mimetype`: The mimetype to stream the result as.
         """
-        self.result = result.clone()
+        self.serializer = None
+        self.references = None
+        if getattr(result, '_document', None) and \
+                issubclass(result._document, JsonifyMixin):
+            # Fast path: stream the projected query straight off the pymongo
+            # cursor and serialize the raw documents. This skips building a
+            # MongoEngine document (and its to_mongo()) for every row.
+            self.serializer = result._document.serializer(fields)
+            self.references = result._document.reference_fields()
+            result = result.clone()._cursor.batch_size(API_FEED_BATCH_SIZE)
+        elif hasattr(result, 'no_cache'):
+            # stream straight off the cursor, there is no need to keep every
+            # document around once it has been serialized
+            result = result.clone().no_cache()
+        self.result = result
         self.fields = fields
-        # NOTE: We must do the count else the cursor will stop at 100
-        self.result_count = self.result.count()
+        self.mimetype = mimetype
+
+    def _data(self, item):
+        if self.serializer is not None:
+            return self.serializer(item)
+        elif isinstance(item, JsonifyMixin):
+            return item.serialize(self.fields)
+        elif isinstance(item, str) or isinstance(item, unicode):
+            return json.loads(item)
+        else:
+            return item
 
     def _json(self, item):
-        if isinstance(item, JsonifyMixin):
-            return item.jsonify(self.fields)
+        if self.serializer is not None:
+            return self.serializer.dumps(item)
         elif isinstance(item, str) or isinstance(item, unicode):
             return str(item)
-        else:
-            return json.dumps(item)
+        return json.dumps(self._data(item), default=handle_special_objs)
+
+    def _prefetched(self):
+        """
+        Iterates over the result in batches, resolving the account references
+        of each batch with a single query before it is serialized. Documents
+        of a model without reference fields are not searched for any.
+        """
+        if self.references == []:
+            for item in self.result:
+                yield item
+            return
+        batch = []
+        for item in self.result:
+            batch.append(item)
+            if len(batch) >= API_FEED_BATCH_SIZE:
+                prefetch_dbrefs(batch, self.references)
+                for item in batch:
+                    yield item
+                batch = []
+        prefetch_dbrefs(batch, self.references)
+        for item in batch:
+            yield item
+
+    def _records(self):
+        for item in self._prefetched():
+            jsons = self._json(item)
+            if jsons == '{}':
+                continue
+            yield '{"fields": ' + jsons + '}'
+
+    def _ndjson(self):
+        for item in self._prefetched():
+            jsons = self._json(item)
+            if jsons == '{}':
+                continue
+            yield jsons + '\n'
+
+    def _msgpack(self):
+        for item in self._prefetched():
+            data = self._data(item)
+            if len(data) == 0:
+                continue
+            yield msgpack.packb(data, default=handle_special_objs)
 
     def __getstate__(self):
         """
         The state returned is just the json string of the object
         """
-        dump = [self._json(o) for o in self.result]
-        return json.dumps((dump, self.fields, self.result_count))
+        # the cursor can only be consumed once, keep the serialized result
+        self.result = [self._json(o) for o in self.result]
+        self.serializer = None
+        return json.dumps((self.result, self.fields, self.mimetype))
 
     def __setstate__(self, state):
         """
         When unpickling, convert the json string into an py-object
         """
-        (self.result, self.fields, self.result_count) = json.loads(state)
+        (self.result, self.fields, self.mimetype) = json.loads(state)
+        self.serializer = None
 
     def __iter__(self):
         """
         The iterator implementing result to json string generator and
         splitting the results by newlines.
         """
-        yield "[\n"
-        count = 0
-        for item in self.result:
-            count += 1
-            jsons = self._json(item)
-            if jsons == '{}':
-                continue
-            data = '{"fields": ' + jsons + '}'
-            if count != self.result_count:
-                yield data + ",\n"
+        if self.mimetype == NDJSON_MIME_TYPE:
+            return self._ndjson()
+        elif self.mimetype == MSGPACK_MIME_TYPE:
+            return self._msgpack()
+        return stream_json_array(self._records())
+
+
+def compress(chunks, encoding):
+    """
+    Generator compressing the given chunks on the fly.
+
+    :Parameters:
+       - `chunks`: An iterable of strings.
+       - `encoding`: The content encoding to use, 'gzip' or 'deflate'.
+    """
+    wbits = zlib.MAX_WBITS
+    if encoding == 'gzip':
+        wbits += 16
+    compressor = zlib.compressobj(
+        API_FEED_COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def cache_chunks(backend, key, chunks):
+    """
+    Generator passing the given chunks through, caching them under the key
+    once all of them have been sent. Output larger than
+    API_FEED_CACHE_MAX_SIZE is not cached.
+
+    The cache backend is passed in as the application context is gone by the
+    time the last chunk has been sent.
+    """
+    size = 0
+    sent = []
+    for chunk in chunks:
+        size += len(chunk)
+        if sent is not None:
+            if size > API_FEED_CACHE_MAX_SIZE:
+                sent = None
             else:
-                yield data
-        yield "]"
+                sent.append(chunk)
+        yield chunk
+    if sent is not None:
+        backend.set(key, [''.join(sent)])
+
+
+def stream_items(items, fields=None, mimetype=None, cache_key=None):
+    """
+    Returns a response streaming the given items in the mimetype requested by
+    the client (unless one is explicitly given), compressed if the client
+    accepts it.
+
+    :Parameters:
+       - `items`: The items to stream.
+       - `fields`: The fields to include for each item.
+       - `mimetype`: The mimetype to stream the items as.
+       - `cache_key`: If given, the encoded output is cached under this key
+         and served from the cache without touching the items.
+    """
+    if mimetype is None:
+        mimetype = negotiate()
+    encoding = negotiate_encoding()
+
+    if current_app.config.get('CACHE_TYPE') == 'null':
+        # do not hold on to the output if it is not going to be cached
+        cache_key = None
+
+    chunks = None
+    if cache_key is not None:
+        cache_key = 'feed/%s' % (sha1(repr(
+            (cache_key, fields, mimetype, encoding))).hexdigest())
+        chunks = cache.get(cache_key)
+
+    if chunks is None:
+        chunks = StreamedSerialResponseValue(items, fields, mimetype)
+        if encoding is not None:
+            chunks = compress(chunks, encoding)
+        if cache_key is not None:
+            chunks = cache_chunks(cache.cache, cache_key, chunks)
+
+    response = make_response(chunks, mimetype=mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def paginate(items, cursor=None, limit=None):
+    """
+    Restricts the given queryset to a single page ordered by (date, id),
+    starting after the position encoded in the cursor. Seeking on the index
+    keeps every page equally cheap regardless of how deep a client is.
+
+    :Parameters:
+       - `items`: A queryset of documents having a date field.
+       - `cursor`: A continuation token as returned by a previous call.
+       - `limit`: The maximum number of items in the page.
 
+    Returns a tuple of the page (as a list) and the continuation token for the
+    next page. The token is None if no more items are available.
+    """
+    if limit is None or limit > API_UPDATES_PAGE_LIMIT:
+        limit = API_UPDATES_PAGE_LIMIT
+    elif limit < 1:
+        raise ValueError('Invalid limit')
+
+    if cursor is not None:
+        try:
+            (millis, last_id) = decode_cursor(cursor)
+            date = from_millis(millis)
+            last_id = ObjectId(str(last_id))
+        except (InvalidId, TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+        items = items.filter(
+            Q(date__gt=date) | Q(date=date, id__gt=last_id)
+        )
 
-def stream_items(items, fields=None):
-    return make_response(StreamedSerialResponseValue(items, fields))
+    page = list(items.order_by('date', 'id').limit(limit))
+
+    next_cursor = None
+    if len(page) == limit:
+        last = page[-1]
+        next_cursor = encode_cursor(to_millis(last.date), str(last.id))
+    return (page, next_cursor)
 
 
 @v2.route('/status.json')
@@ -158,6 +418,71 @@ def status():
     return make_response(data)
 
 
+def watermark(group, mark):
+    """
+    Returns the time the hashes (mark='updated') or removals (mark='removed')
+    of a group last changed. If no mark has been recorded yet, it is looked up
+    from the latest item.
+    """
+    state = GroupState.objects(group=group).first()
+    value = getattr(state, mark) if state else None
+    if value is None:
+        model = Hash if mark == 'updated' else Removal
+        latest = model.objects(group=group).only('date').order_by(
+            '-date').first()
+        value = latest.date if latest else datetime.datetime(1970, 1, 1)
+    return value
+
+
+def conditional(mark):
+    """
+    Decorator for group feed views answering conditional requests using the
+    high-water mark of the group, before any items are queried.
+
+    :Parameters:
+       - `mark`: The GroupState mark ('updated' or 'removed') of the feed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(group, since):
+            value = watermark(group, mark)
+            etag = sha1('%s %s %s %s' % (
+                value.isoformat(), request.full_path, negotiate(),
+                negotiate_encoding()
+            )).hexdigest()
+            # made available to views for use in cache keys
+            g.watermark = value
+
+            # Last-Modified has a resolution of seconds, so it is rounded up
+            # and only provided once no further change can fall within it.
+            last_modified = value.replace(microsecond=0)
+            if last_modified < value:
+                last_modified += datetime.timedelta(seconds=1)
+            if last_modified > datetime.datetime.utcnow():
+                last_modified = None
+
+            if request.if_none_match:
+                unmodified = request.if_none_match.contains(etag)
+            else:
+                unmodified = request.if_modified_since is not None and \
+                    value <= request.if_modified_since
+
+            if unmodified:
+                response = make_response('', 304)
+            else:
+                response = view(group, since)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            response.vary.add('Accept-Encoding')
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
 # Routing Regexes
 _SINCE_REGEX = '<regex("[0-9\-]{8,}T[0-9:]{8}"):since>'
 _GROUP_REGEX = '<regex("%s"):group>' % ('|'.join(SUBMISSION_GROUPS.keys()))
@@ -167,19 +492,32 @@ _START_DATE = '1970-01-01T00:00:00'
 @v2.route('/update/%s/' % (_GROUP_REGEX), defaults={'since': _START_DATE})
 @v2.route('/update/%s/' % (_SINCE_REGEX), defaults={'group': DEFAULT_GROUP})
 @v2.route('/update/%s/<since>/' % (_GROUP_REGEX), methods=['GET'])
+@conditional('updated')
 def update(group, since):
     """
     Returns all items updated  past a specific date in utc.
 
+    If a `limit` or `cursor` argument is given, a single page of items is
+    returned and the continuation token for the next page is provided in the
+    response header named by CURSOR_HEADER.
+
     :Parameters:
        - `since`: a specific date in utc
        - `group`: group to limit items to
     """
     try:
-        items = Hash.objects(
-            date__gt=datetime.datetime.strptime(since, "%Y-%m-%dT%H:%M:%S"),
-            group=group
-        )
+        timestamp = datetime.datetime.strptime(since, "%Y-%m-%dT%H:%M:%S")
+        limit = request.args.get('limit', None)
+        cursor = request.args.get('cursor', None)
+        paginated = limit is not None or cursor is not None
+
+        if API_UPDATES_SINCE_BUCKET and not paginated:
+            # share cached responses by serving from the start of the bucket
+            bucket = to_millis(timestamp) // 1000
+            bucket -= bucket % API_UPDATES_SINCE_BUCKET
+            timestamp = datetime.datetime.utcfromtimestamp(bucket)
+
+        items = Hash.objects(date__gt=timestamp, group=group)
 
         fields = API_UPDATES_DEFAULT_FIELDS
 
@@ -190,28 +528,109 @@ def update(group, since):
                 for field in fields_arg.replace(' ', '').split(',')
             ]
 
-        items = items.only(*fields)
-        return stream_items(items, fields)
+        if not paginated:
+            if fields == API_UPDATES_DEFAULT_FIELDS:
+                # stream the json stored along with each hash
+                items = Hash.rendered(items)
+            else:
+                items = items.only(*fields)
+            return stream_items(
+                items, fields,
+                cache_key=('update', group, timestamp, g.watermark)
+            )
+
+        # the date is required to build the continuation token
+        items = items.only(*(list(fields) + ['date']))
+        if limit is not None:
+            limit = int(limit)
+        (page, next_cursor) = paginate(items, cursor, limit)
+        response = stream_items(page, fields)
+        if next_cursor is not None:
+            response.headers[CURSOR_HEADER] = next_cursor
+        return response
+    except Exception as e:
+        current_app.logger.debug(e)
+        return error()
+
+
+def send_snapshot(group):
+    """
+    Builds the response for the current snapshot file of a group. The file is
+    handed off to the front end web server if configured to do so.
+    """
+    path = snapshots.snapshot_path(group)
+    accel = current_app.config.get('SNAPSHOT_ACCEL_REDIRECT')
+    if accel:
+        response = Response(mimetype=SNAPSHOT_MIME_TYPE)
+        response.headers['X-Accel-Redirect'] = '%s/%s' % (
+            accel.rstrip('/'), basename(path))
+        response.set_etag(snapshots.snapshot_etag(group))
+        response.last_modified = snapshots.snapshot_date(group)
+        response.make_conditional(request)
+    else:
+        # handles etags, range requests and X-Sendfile (USE_X_SENDFILE)
+        response = send_file(
+            path, mimetype=SNAPSHOT_MIME_TYPE, as_attachment=True,
+            attachment_filename=basename(path), conditional=True
+        )
+    response.headers[SNAPSHOT_HEADER] = snapshots.snapshot_date(
+        group).strftime('%Y-%m-%dT%H:%M:%S')
+    return response
+
+
+@v2.route('/snapshot/%s/' % (_GROUP_REGEX), methods=['GET'])
+def snapshot(group):
+    """
+    Returns the snapshot of all items in a group as a gzip compressed file of
+    newline delimited JSON records. This is a cheaper alternative to an update
+    since the start of time. The date of the snapshot is provided in the
+    response header named by SNAPSHOT_HEADER, clients are expected to continue
+    with updates and removals since that date.
+
+    :Parameters:
+       - `group`: group to get the snapshot for
+    """
+    try:
+        if snapshots.is_dirty(group) and not snapshots.is_generating(group):
+            snapshots.refresh(group)
+
+        if snapshots.snapshot_date(group) is None:
+            response = error('Snapshot not available yet, retry later.', 503)
+            response.headers['Retry-After'] = '60'
+            return response
+
+        return send_snapshot(group)
     except Exception as e:
         current_app.logger.debug(e)
         return error()
 
 
 @v2.route('/remove/%s/' % (_SINCE_REGEX), defaults={'group': DEFAULT_GROUP})
-@v2.route('/update/%s/<since>/' % (_GROUP_REGEX), methods=['GET'])
-@cache.memoize()
+@v2.route('/remove/%s/<since>/' % (_GROUP_REGEX), methods=['GET'])
+@conditional('removed')
 def remove(group, since):
     """
     Returns all items to remove past a specific date in utc.
 
+    If removals after the given date have since been expired, a 410 response
+    marked with resync is returned instead. The client then has to start
+    over from a snapshot.
+
     :Parameters:
        - `since`: a specific date in utc
        - `group`: group to limit items to
     """
     try:
         timestamp = datetime.datetime.strptime(since, "%Y-%m-%dT%H:%M:%S")
+        state = GroupState.objects(group=group).only('horizon').first()
+        if state and state.horizon and timestamp < state.horizon:
+            return error(
+                'Resync required, removals before %s have expired' % (
+                    state.horizon.isoformat()),
+                410, resync=True, horizon=state.horizon.isoformat())
         items = Removal.objects(date__gt=timestamp, group=group)
-        return stream_items(items)
+        return stream_items(
+            items, cache_key=('remove', group, timestamp, g.watermark))
     except:
         return error()
 
@@ -229,26 +648,109 @@ def cves_algorithm(algorithm, arg):
        - `arg`: The fingerprint.
     """
     try:
-        algorithms = ['sha512', 'sha1', 'md5']
-        if algorithm not in algorithms:
+        if algorithm not in ALGORITHMS:
             return error('Invalid alogrithm. Use any of %s.' % (
-                ', '.join(algorithms)))
-        elif len(arg) not in [32, 40, 128]:
+                ', '.join(ALGORITHMS)))
+        elif len(arg) not in CHECKSUM_LENGTHS.values():
             return error('Invalid checksum length for %s' % (algorithm))
 
+        if not fingerprint_filter.might_contain(algorithm, arg):
+            return stream_items([], ['cves'])
+
         kwargs = {("hashes__%s__combined" % (algorithm)): arg}
-        cves = Hash.objects.only('cves').filter(**kwargs)
+        cves = list(Hash.objects.only('cves').filter(**kwargs))
+        if len(cves) == 0:
+            fingerprint_filter.record_miss()
         return stream_items(cves, ['cves'])
     except Exception:
         return error()
 
 
+def fingerprint_matches(fingerprints):
+    """
+    Generator yielding a {algorithm, fingerprint, cves} record for every hash
+    matching one of the given fingerprints. A single query is issued per
+    algorithm.
+
+    :Parameters:
+       - `fingerprints`: A dict of algorithm to a list of fingerprints.
+    """
+    for algorithm in ALGORITHMS:
+        if not fingerprints.get(algorithm):
+            continue
+        field = 'hashes.%s.combined' % (algorithm)
+        kwargs = {
+            ('hashes__%s__combined__in' % (algorithm)): fingerprints[algorithm]
+        }
+        matches = Hash.objects(**kwargs).only('cves', field)
+        # raw documents, there is no need for a Hash instance per match
+        for match in matches._cursor.batch_size(API_FEED_BATCH_SIZE):
+            yield {
+                'algorithm': algorithm,
+                'fingerprint': match['hashes'][algorithm]['combined'],
+                'cves': [cve['id'] for cve in match.get('cves', [])],
+            }
+
+
+@v2.route('/cves/', methods=['POST'])
+def cves_batch():
+    """
+    Returns the cves of all hashes matching any of the posted fingerprints.
+
+    Expects a json object mapping algorithms to lists of fingerprints, eg:
+    {"sha512": [...], "md5": [...]}. Each match is streamed as a record of
+    the algorithm, fingerprint and cves. Fingerprints without a match are
+    left out.
+    """
+    try:
+        data = request.get_json(force=True, silent=True)
+        if not isinstance(data, dict) or len(data) == 0:
+            raise ValueError('Expected a mapping of algorithm to fingerprints')
+
+        fingerprints = {}
+        count = 0
+        for (algorithm, values) in data.items():
+            if algorithm not in ALGORITHMS:
+                raise ValueError('Invalid alogrithm. Use any of %s.' % (
+                    ', '.join(ALGORITHMS)))
+            if not isinstance(values, list):
+                raise ValueError(
+                    'Expected a list of fingerprints for %s' % (algorithm))
+            for value in values:
+                if not isinstance(value, basestring) or \
+                        len(value) != CHECKSUM_LENGTHS[algorithm]:
+                    raise ValueError(
+                        'Invalid checksum length for %s' % (algorithm))
+            fingerprints[algorithm] = set(values)
+            count += len(fingerprints[algorithm])
+
+        limit = current_app.config.get('API_BATCH_LOOKUP_LIMIT')
+        if count > limit:
+            raise ValueError(
+                'Too many fingerprints, at most %d are allowed' % (limit))
+
+        # definite misses need not be queried for
+        for algorithm in fingerprints:
+            fingerprints[algorithm] = [
+                value for value in fingerprints[algorithm]
+                if fingerprint_filter.might_contain(algorithm, value)
+            ]
+
+        return stream_items(fingerprint_matches(fingerprints))
+    except ValueError as ve:
+        return error(ve.message)
+    except Exception as e:
+        current_app.logger.debug(e.message)
+        return error()
+
+
 @v2.route('/cves/<group>/', methods=['GET'])
 def cves(group):
     """
     Get cves that match the given coordinates for the specified group.
 
-    Expectes coordinates as arguments.
+    Expectes coordinates as arguments. Versions can also be matched by range
+    using the version_lt, version_le, version_gt and version_ge arguments.
 
     :Parameters:
         - `group`: The group for which to search in
@@ -264,6 +766,14 @@ def cves(group):
         if len(kwargs) == 0:
             raise ValueError('No coordinates given')
 
+        for (arg, operator) in VERSION_RANGE_ARGS:
+            if arg in request.args:
+                key = version_key(group, request.args.get(arg).strip())
+                if key is None:
+                    raise ValueError('Version ranges not supported for %s' % (
+                        group))
+                kwargs['_version_key__%s' % (operator)] = key
+
         kwargs['group'] = group
         fields = ['cves', 'coordinates']
         cves = Hash.objects.only(*fields).filter(**kwargs)
@@ -275,6 +785,157 @@ def cves(group):
         return error()
 
 
+def parse_coordinates(group, entry):
+    """
+    Converts a posted coordinate entry into a dict of coordinates. An entry
+    is either a dict or a string of values separated by ':' in the order the
+    group defines its coordinates (eg: groupId:artifactId:version).
+
+    :Parameters:
+       - `group`: The group the coordinates belong to.
+       - `entry`: The posted entry.
+    """
+    keys = SUBMISSION_GROUPS.get(group)
+    if isinstance(entry, basestring):
+        values = entry.split(':')
+        if len(values) > len(keys):
+            raise ValueError('Too many coordinates in %s' % (entry))
+        entry = dict(zip(keys, values))
+    elif not isinstance(entry, dict):
+        raise ValueError('Coordinates must be given as a string or an object')
+
+    coordinates = {}
+    for key in keys:
+        value = entry.get(key)
+        if isinstance(value, basestring) and len(value.strip()) > 0:
+            coordinates[key] = value.strip()
+
+    if len(coordinates) == 0:
+        raise ValueError('No coordinates given')
+    return coordinates
+
+
+def coordinate_matches(group, entries):
+    """
+    Generator yielding an {index, coordinates, cves} record for every hash
+    matching a coordinate entry, where index is the position of the entry
+    in the given list. All entries are resolved using a single query.
+
+    :Parameters:
+       - `group`: The group to search in.
+       - `entries`: A list of coordinate dicts.
+    """
+    # entries keyed by the coordinates they specify and then their values
+    lookup = {}
+    query = None
+    for (index, coordinates) in enumerate(entries):
+        keys = tuple(sorted(coordinates.keys()))
+        values = tuple(coordinates[key] for key in keys)
+        lookup.setdefault(keys, {}).setdefault(values, []).append(index)
+
+        # group in every clause so that each can use the coordinates index
+        kwargs = dict(
+            ('coordinates__%s' % (key), value)
+            for (key, value) in coordinates.items()
+        )
+        clause = Q(group=group, **kwargs)
+        query = clause if query is None else query | clause
+
+    fields = ['cves', 'coordinates']
+    matches = Hash.objects(query).only(*fields)
+    for match in matches._cursor.batch_size(API_FEED_BATCH_SIZE):
+        coordinates = match.get('coordinates') or {}
+        cves = [cve['id'] for cve in match.get('cves', [])]
+        for (keys, indexes) in lookup.items():
+            values = tuple(coordinates.get(key) for key in keys)
+            for index in indexes.get(values, []):
+                yield {
+                    'index': index,
+                    'coordinates': coordinates,
+                    'cves': cves,
+                }
+
+
+@v2.route('/cves/<group>/', methods=['POST'])
+def cves_batch_coordinates(group):
+    """
+    Get cves that match any of the posted coordinates for the specified group.
+
+    Expects a json list of coordinates, each either an object or a string of
+    values separated by ':' (eg: "groupId:artifactId:version" for java). Each
+    match is streamed as a record tagged with the index of the entry in the
+    posted list.
+
+    :Parameters:
+        - `group`: The group for which to search in
+    """
+    try:
+        if group not in groups():
+            raise ValueError('Invalid group specified')
+
+        data = request.get_json(force=True, silent=True)
+        if not isinstance(data, list) or len(data) == 0:
+            raise ValueError('Expected a list of coordinates')
+
+        limit = current_app.config.get('API_BATCH_LOOKUP_LIMIT')
+        if len(data) > limit:
+            raise ValueError(
+                'Too many coordinates, at most %d are allowed' % (limit))
+
+        entries = [parse_coordinates(group, entry) for entry in data]
+        return stream_items(coordinate_matches(group, entries))
+    except ValueError as ve:
+        return error(ve.message)
+    except Exception as e:
+        current_app.logger.debug(e.message)
+        return error()
+
+
+@v2.route('/search/', methods=['GET'])
+def search_hashes():
+    """
+    Search released hashes by name, CVE id and coordinates. Every whitespace
+    separated term of the `q` argument has to match the start of one of these
+    (or of one of their alphanumeric parts).
+
+    Results are returned a page (of at most `limit` items) at a time, the
+    continuation token for the next page is provided in the response header
+    named by CURSOR_HEADER. The `groups` argument restricts the search to a
+    comma separated list of groups.
+    """
+    try:
+        query = request.args.get('q', '')
+        if len(query.strip()) == 0:
+            raise ValueError('No search query given')
+
+        _groups = request.args.get('groups', None)
+        if _groups is not None:
+            _groups = [g.strip() for g in _groups.split(',')]
+
+        fields = API_UPDATES_DEFAULT_FIELDS
+        fields_arg = request.args.get('fields', None)
+        if fields_arg is not None:
+            fields = [
+                Hash.modelname(field)
+                for field in fields_arg.replace(' ', '').split(',')
+            ]
+
+        limit = request.args.get('limit', None)
+        if limit is not None:
+            limit = int(limit)
+        (page, next_cursor) = search(
+            query, _groups, request.args.get('cursor', None), limit, fields)
+        response = stream_items(page, fields)
+        if next_cursor is not None:
+            response.headers[CURSOR_HEADER] = next_cursor
+        return response
+    except ValueError as ve:
+        return error(ve.message)
+    except Exception as e:
+        current_app.logger.debug(e.message)
+        return error()
+
+
 @v2.route('/submit/hash/<group>/', methods=['PUT'])
 @apiauth
 def submit_hash(group):
@@ -342,6 +1003,8 @@ def submit_archive(group):
         return error()
 
 SUBMISSION_ROUTES = [submit_hash, submit_archive]
+# read-only routes that are posted to
+LOOKUP_ROUTES = [cves_batch, cves_batch_coordinates]
 
 for v in [update, remove, cves]:
     ssl_exclude(update)
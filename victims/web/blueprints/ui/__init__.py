@@ -20,19 +20,25 @@ Main web ui.
 
 import flask_login as login
 import re
+from hashlib import sha1
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
 from flask import (
     Blueprint, current_app, escape, render_template, helpers,
-    url_for, request, redirect, flash)
+    url_for, request, redirect, flash, Markup)
+from mongoengine import Q
 
 from victims.web.cache import cache
-from victims.web.config import SUBMISSION_GROUPS
+from victims.web.config import SUBMISSION_GROUPS, UI_HASHES_PAGE_SIZE
 from victims.web.errors import ValidationError
 from victims.web.handlers.forms import \
     SUBMISSION_FORMS, ArtifactSubmit, flash_errors
-from victims.web.models import Hash, CoordinateDict
+from victims.web.models import Hash, CoordinateDict, GroupState
 from victims.web.plugin.crosstalk import indexmon
 from victims.web.submissions import submit, upload
-from victims.web.util import groups
+from victims.web.util import (
+    groups, encode_cursor, decode_cursor, to_millis, from_millis, search
+)
 
 ui = Blueprint(
     'ui', __name__,
@@ -55,27 +61,130 @@ def _is_hash(data):
 
 @ui.route('/', methods=['GET'])
 def index():
-    _cache_key = 'view/%s/get_data' % (request.path)
+    return render_template('index.html', **indexmon.get_data())
 
-    @cache.cached(key_prefix=_cache_key)
-    def get_data():
-        indexmon.refresh(True)
-        return indexmon.get_data()
 
-    if indexmon.refreshed_flag:
-        cache.delete(_cache_key)
-        # make sure cached hashes for ui.hashes are cleared
-        cache.delete_memoized(hashes)
-        indexmon.refreshed_flag = False
-    return render_template('index.html', **get_data())
+# sort orders of the hashes browser; field and direction
+HASH_SORTS = {
+    'name': ('name', 1),
+    'date': ('date', -1),
+}
+HASH_FIELDS = ['name', 'version', 'date', 'hashes.sha512.combined']
+
+
+def _after(field, direction, value, last_id):
+    """
+    Query matching the hashes sorted after the given position.
+    """
+    op = 'gt' if direction > 0 else 'lt'
+    same = Q(**{field: value, 'id__%s' % (op): last_id})
+    if value is None:
+        # nulls sort first and do not compare with other values
+        if direction > 0:
+            return same | Q(**{'%s__ne' % (field): None})
+        return same
+    return same | Q(**{'%s__%s' % (field, op): value})
+
+
+def hashes_page(groups, sort='name', cursor=None, limit=None):
+    """
+    A page of released hashes in the given groups ordered by the sort,
+    starting after the position encoded in the cursor. Each group is read
+    off its own index and the results merged, so a page costs at most one
+    page of rows per group however deep it is.
+
+    :Parameters:
+       - `groups`: The groups to list hashes of.
+       - `sort`: The sort order, one of HASH_SORTS.
+       - `cursor`: A continuation token as returned by a previous call.
+       - `limit`: The number of hashes in a page.
+
+    Returns a tuple of the page (raw documents) and the continuation token for
+    the next page, which is None on the last page.
+    """
+    (field, direction) = HASH_SORTS[sort]
+    if limit is None:
+        limit = UI_HASHES_PAGE_SIZE
+
+    after = None
+    if cursor is not None:
+        try:
+            (value, last_id) = decode_cursor(cursor)
+            if field == 'date':
+                value = from_millis(value)
+            after = _after(field, direction, value, ObjectId(str(last_id)))
+        except (InvalidId, TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+
+    order = '%s%%s' % ('' if direction > 0 else '-')
+    rows = []
+    for group in groups:
+        items = Hash.objects(status='RELEASED', group=group)
+        if after is not None:
+            items = items.filter(after)
+        items = items.order_by(order % (field), order % ('id'))
+        rows.extend(items.only(*HASH_FIELDS).limit(limit + 1).as_pymongo())
+
+    rows.sort(
+        key=lambda row: (row.get(field), row['_id']), reverse=direction < 0)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        value = last.get(field)
+        if field == 'date':
+            value = to_millis(value)
+        next_cursor = encode_cursor(value, str(last['_id']))
+    return (rows, next_cursor)
+
+
+def _render_hashes(groups, sort, cursor):
+    (rows, next_cursor) = hashes_page(groups, sort, cursor)
+    return (render_template('hashes_page.html', hashes=rows), next_cursor)
 
 
 @cache.memoize()
+def _hashes_fragment(groups, sort, cursor, watermarks):
+    return _render_hashes(groups, sort, cursor)
+
+
+def _issued_key(cursor):
+    return 'view/hashes/cursor/%s' % (sha1(cursor).hexdigest())
+
+
 def hashes(groups):
-    hashes = Hash.objects(
-        status='RELEASED', group__in=groups
-    ).only('name', 'version', 'hashes.sha512.combined')
-    return render_template('hashes.html', hashes=hashes)
+    sort = request.args.get('sort', 'name')
+    if sort not in HASH_SORTS:
+        sort = 'name'
+    cursor = request.args.get('cursor', None)
+    groups = sorted(groups)
+
+    try:
+        if cursor is None or cache.get(_issued_key(cursor)):
+            # cached pages are replaced once a hash in the groups changes
+            watermarks = sorted(
+                (state.group, state.updated) for state in
+                GroupState.objects(group__in=groups).only('updated'))
+            (rows, next_cursor) = _hashes_fragment(
+                groups, sort, cursor, watermarks)
+        else:
+            # only pages linked to by this server are cached, so that made
+            # up cursors can not fill the cache
+            (rows, next_cursor) = _render_hashes(groups, sort, cursor)
+    except ValueError:
+        flash('Not a valid page, displaying the first one.', 'error')
+        args = request.args.to_dict()
+        args.pop('cursor', None)
+        args.update(request.view_args)
+        return redirect(url_for(request.endpoint, **args))
+
+    if next_cursor is not None:
+        cache.set(_issued_key(next_cursor), True)
+
+    return render_template(
+        'hashes.html', rows=Markup(rows), groups=groups, sort=sort,
+        sorts=sorted(HASH_SORTS), next_cursor=next_cursor,
+        all_groups=sorted(SUBMISSION_GROUPS.keys()))
 
 
 @ui.route('/hashes/%s/' % (_GROUP_REGEX), methods=['GET'])
@@ -84,7 +193,7 @@ def hashes_singlegroup(group):
         flash(
             '%s is not a known group. Displaying all hashes.' % (group),
             'error')
-        return render_template('hashes.html', hashes=[])
+        return redirect(url_for('ui.hashes_multigroup'))
     return hashes([group])
 
 
@@ -98,10 +207,30 @@ def hashes_multigroup():
         _groups = groups()
     else:
         _groups = [str(g.strip()) for g in _groups.split(',')]
+        unknown = [g for g in _groups if g not in groups()]
+        if unknown:
+            flash('Unknown groups: %s' % (', '.join(unknown)), 'error')
+            _groups = [g for g in _groups if g in groups()]
 
     return hashes(_groups)
 
 
+@ui.route('/search/', methods=['GET'])
+def search_hashes():
+    query = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor', None)
+    (results, next_cursor) = ([], None)
+    if query:
+        try:
+            (results, next_cursor) = search(
+                query, cursor=cursor, fields=HASH_FIELDS)
+        except ValueError:
+            flash('Not a valid page, displaying the first one.', 'error')
+            return redirect(url_for('ui.search_hashes', q=query))
+    return render_template(
+        'search.html', query=query, hashes=results, next_cursor=next_cursor)
+
+
 @ui.route('/hash/<value>', methods=['GET'])
 def onehash(value):
     if _is_hash(value):
@@ -3,6 +3,7 @@ from os.path import isfile, isdir, join
 from datetime import timedelta
 from imp import load_source
 from logging import getLogger, DEBUG as LOG_LEVEL_DEBUG
+from multiprocessing import cpu_count
 
 _ENFORCE = True
 _ENFORCE_KEYS = ['SECRET_KEY', 'DEBUG', 'TESTING']
@@ -17,6 +18,49 @@ LOG_LEVEL = LOG_LEVEL_DEBUG
 FLASK_HOST = environ.get('FLASK_HOST', '127.0.0.1')
 FLASK_PORT = int(environ.get('FLASK_PORT', 5000))
 
+# Background tasks are either run by a pool of threads in each process
+# ('local') or queued in the database ('queue') for workers started with
+# python -m victims.web worker. Tasks use files in VICTIMS_BASE_DIR, which has
+# to be shared with workers on other nodes.
+TASK_BACKEND = environ.get('VICTIMS_TASK_BACKEND', 'local')
+# Size of the local pool and the maximum number of tasks waiting for it. Tasks
+# added to a full queue are dropped ('drop') or run by the caller ('caller').
+TASK_WORKERS = 4
+TASK_QUEUE_LIMIT = 100
+TASK_OVERFLOW_POLICY = 'drop'
+# Number of concurrent workers (processes) started by the worker command
+WORKER_CONCURRENCY = int(
+    environ.get('VICTIMS_WORKER_CONCURRENCY', cpu_count()))
+# Seconds a worker may hold a job without a heartbeat before it is retried
+JOBS_LEASE = 60
+# Attempts before a job is given up on; retries back off exponentially
+# starting from JOBS_BACKOFF seconds up to JOBS_BACKOFF_MAX
+JOBS_MAX_ATTEMPTS = 5
+JOBS_BACKOFF = 30
+JOBS_BACKOFF_MAX = 60 * 60
+# Seconds an idle worker waits before looking for jobs again
+JOBS_POLL_INTERVAL = 1
+# Finished jobs are kept this long
+JOBS_RETENTION = timedelta(days=7)
+
+# Production server (python -m victims.web serve)
+SERVER_WORKERS = int(
+    environ.get('VICTIMS_SERVER_WORKERS', cpu_count() * 2 + 1))
+# 'sync' or, if gevent is installed, 'gevent'. Slow clients reading a long
+# streamed feed tie up a sync worker each, a gevent worker serves many.
+SERVER_WORKER_CLASS = environ.get('VICTIMS_SERVER_WORKER_CLASS', 'sync')
+# Maximum concurrent clients per worker (gevent only)
+SERVER_WORKER_CONNECTIONS = 1000
+# Workers silent for longer are killed and restarted
+SERVER_TIMEOUT = 120
+# Time given to workers to finish their requests on a reload or shutdown
+SERVER_GRACEFUL_TIMEOUT = 60
+SERVER_KEEPALIVE = 2
+# Restart workers after this many requests, 0 to disable
+SERVER_MAX_REQUESTS = 0
+# Write the master's pid here, eg: to send it HUP for a graceful reload
+SERVER_PIDFILE = None
+
 DEBUG = 'VICTIMS_DEBUG' in environ
 TESTING = 'VICTIMS_TESTING' in environ
 SECRET_KEY = b'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
@@ -29,6 +73,14 @@ ALLOWED_EXTENSIONS = set(['egg', 'jar', 'gem'])
 # File download
 DOWNLOAD_FOLDER = join(VICTIMS_BASE_DIR, "downloads")
 
+# Snapshots of each group for full database downloads
+SNAPSHOT_FOLDER = join(VICTIMS_BASE_DIR, "snapshots")
+# When served behind nginx, set this to the internal location mapped to
+# SNAPSHOT_FOLDER (eg: '/protected/snapshots/') to use X-Accel-Redirect.
+SNAPSHOT_ACCEL_REDIRECT = None
+# When served behind apache/lighttpd, enable this to use X-Sendfile.
+USE_X_SENDFILE = False
+
 # Cache Configuration
 CACHE_TYPE = 'null'
 CACHE_DIR = environ.get('VICTIMS_CACHE_DIR', join(VICTIMS_BASE_DIR, 'cache'))
@@ -51,9 +103,6 @@ SESSION_PROTECTION = 'strong'
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_NAME = 'victims'
 
-# MongoEngine Session reaps are performed every SESSION_REAP_PERIOD
-SESSION_REAP_PERIOD = timedelta(days=1)
-
 # Cookie
 REMEMBER_COOKIE_NAME = 'remember_token'
 REMEMBER_COOKIE_DURATION = timedelta(1)
@@ -81,12 +130,67 @@ SUBMISSION_GROUPS = {
     'ruby': ['gem', 'version'],
 }
 
+# Number of hashes listed on each page of the hashes browser
+UI_HASHES_PAGE_SIZE = 100
+
+# Search results per page (the most an API client may request per page)
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_LIMIT = 1000
+# Search keywords (prefixes of values and of their parts) are capped at
+# SEARCH_KEYWORD_LENGTH characters
+SEARCH_KEYWORD_LENGTH = 32
+
+# Seconds the front page statistics are served before being revalidated (in
+# the background) against the version stamp of the counts
+FRONT_PAGE_STATS_CHECK = 10
+
+# Seconds a plugin configuration is read from memory before checking whether
+# it was changed in the database
+PLUGIN_CONFIG_CHECK = 5
+
+# Number of usernames of referenced accounts cached by each worker
+USERNAME_CACHE_SIZE = 1024
+
+# Removals older than this are expired by compaction (None to keep them all).
+# Clients that last synced before the expired removals have to resync.
+REMOVALS_RETENTION = timedelta(days=365)
+
+# The versioning scheme used to order the versions of each group; one of
+# 'maven', 'pep440' or 'rubygems'
+VERSION_SCHEMES = {
+    'java': 'maven',
+    'python': 'pep440',
+    'ruby': 'rubygems',
+}
+
 # API Configuration
 VICTIMS_API_HEADER = 'X-Victims-Api'
 API_REQUEST_EXPIRY_MINS = 3
 API_UPDATES_DEFAULT_FIELDS = [
     'cves', 'metadata', 'hash', 'hashes.sha512'
 ]
+# Maximum number of items returned in a single page of a paginated update
+API_UPDATES_PAGE_LIMIT = 5000
+# If set, updates are served from the start of the bucket (in seconds) the
+# requested date falls into, so that responses can be shared in the cache.
+API_UPDATES_SINCE_BUCKET = None
+# Feed responses up to this size (in bytes, after compression) are cached
+API_FEED_CACHE_MAX_SIZE = 4 * 1024 * 1024
+# zlib compression level used for gzip/deflate encoded feed responses
+API_FEED_COMPRESSION_LEVEL = 6
+# Number of documents fetched per round trip when streaming feeds
+API_FEED_BATCH_SIZE = 1000
+# Maximum number of fingerprints accepted by a single batch lookup
+API_BATCH_LOOKUP_LIMIT = 5000
+
+# In-memory filter answering fingerprint lookups that are definite misses.
+# New hashes are seen by the filter within FINGERPRINT_FILTER_REFRESH seconds.
+FINGERPRINT_FILTER_ENABLED = True
+FINGERPRINT_FILTER_REFRESH = 60
+FINGERPRINT_FILTER_ERROR_RATE = 0.001
+FINGERPRINT_FILTER_MIN_CAPACITY = 10000
+# Rebuild once the removals since the last build exceed this share of entries
+FINGERPRINT_FILTER_REBUILD_RATIO = 0.1
 
 # plugin.charon
 MAVEN_REPOSITORIES = [('jboss-ga', 'https://maven.repository.redhat.com/ga/')]
@@ -134,7 +238,8 @@ else:
     PREFERRED_URL_SCHEME = 'https'
 
 # Create any required directories
-for folder in [LOG_FOLDER, UPLOAD_FOLDER, DOWNLOAD_FOLDER, CACHE_DIR]:
+for folder in [LOG_FOLDER, UPLOAD_FOLDER, DOWNLOAD_FOLDER, CACHE_DIR,
+               SNAPSHOT_FOLDER]:
     if not isdir(folder):
         makedirs(folder)
 
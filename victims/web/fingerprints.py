@@ -0,0 +1,271 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+In-memory filter of known fingerprints.
+
+Every worker keeps a Bloom filter of the combined hashes (per algorithm) in
+the database. A fingerprint that is not in the filter is definitely not in
+the database, so the lookup can be answered without a round trip. The filter
+is refreshed from Hash.date in the background and can lag behind the database
+by at most FINGERPRINT_FILTER_REFRESH seconds (plus the time to refresh).
+
+Entries cannot be removed from a Bloom filter. Removals only increase the
+false positive rate, hence the filter is rebuilt once the number of removals
+seen since the last build exceeds FINGERPRINT_FILTER_REBUILD_RATIO.
+"""
+from datetime import datetime, timedelta
+from hashlib import md5
+from math import ceil, exp, log
+from struct import unpack
+
+from victims.web import config
+from victims.web.handlers.refresh import BackgroundRefresh
+from victims.web.models import Hash, Removal
+
+# Hashes saved concurrently may be written in a different order than their
+# dates, always go back this far when fetching what changed
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+def _bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class BloomFilter(object):
+    """
+    A plain Bloom filter sized for a given capacity and false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate):
+        """
+        Creates an empty filter.
+
+        :Parameters:
+           - `capacity`: The number of entries the filter is sized for.
+           - `error_rate`: The false positive rate at full capacity.
+        """
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self.hashes = max(int(round(self.bits * log(2) / capacity)), 1)
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, value):
+        # double hashing, see Kirsch and Mitzenmacher
+        (h1, h2) = unpack('<QQ', md5(value).digest())
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        for position in self._positions(value):
+            if not self._array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def size(self):
+        """
+        Size of the bit array in bytes.
+        """
+        return len(self._array)
+
+    @property
+    def false_positive_rate(self):
+        """
+        The expected false positive rate given the number of entries added.
+        """
+        return (1 - exp(-float(self.hashes) * self.count / self.bits)) \
+            ** self.hashes
+
+
+class FingerprintFilter(BackgroundRefresh):
+    """
+    Per algorithm Bloom filters of all fingerprints in the database.
+    """
+
+    name = 'fingerprint filter'
+
+    def __init__(self, algorithms):
+        """
+        :Parameters:
+           - `algorithms`: The fingerprinting algorithms to keep filters for.
+        """
+        BackgroundRefresh.__init__(self)
+        self.algorithms = algorithms
+        self.filters = None
+        self.updated = None
+        self.removed = None
+        self.removals = 0
+        self.builds = 0
+        self.lookups = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    def init_app(self, app):
+        """
+        Load the filter in the background once a worker starts serving.
+        """
+        app.before_first_request(self.schedule)
+
+    @property
+    def enabled(self):
+        return config.FINGERPRINT_FILTER_ENABLED
+
+    @property
+    def interval(self):
+        return config.FINGERPRINT_FILTER_REFRESH
+
+    def _fetch(self, since):
+        """
+        Raw documents of all hashes changed after `since` (None for all).
+        """
+        fields = ['date'] + [
+            'hashes.%s.combined' % (algorithm)
+            for algorithm in self.algorithms
+        ]
+        groups = config.SUBMISSION_GROUPS.keys()
+        # per group so that the group/date index is used, plus any hashes with
+        # a missing or unknown group as those are looked up all the same
+        querysets = [Hash.objects(group=group) for group in groups]
+        querysets.append(Hash.objects(group__nin=groups))
+        for items in querysets:
+            if since is not None:
+                items = items.filter(date__gt=since - REFRESH_OVERLAP)
+            items = items.only(*fields)._cursor.batch_size(
+                config.API_FEED_BATCH_SIZE)
+            for item in items:
+                yield item
+
+    def _add(self, filters, item):
+        hashes = item.get('hashes') or {}
+        for algorithm in self.algorithms:
+            combined = (hashes.get(algorithm) or {}).get('combined')
+            if combined:
+                filters[algorithm].add(_bytes(combined))
+
+    def build(self):
+        """
+        (Re)builds the filters from all hashes in the database.
+        """
+        started = datetime.utcnow()
+        removed = Removal.objects.order_by('-date').only('date').first()
+        capacity = max(
+            Hash.objects.count() * 2, config.FINGERPRINT_FILTER_MIN_CAPACITY)
+        filters = dict(
+            (algorithm, BloomFilter(
+                capacity, config.FINGERPRINT_FILTER_ERROR_RATE))
+            for algorithm in self.algorithms
+        )
+        for item in self._fetch(None):
+            self._add(filters, item)
+
+        with self._lock:
+            self.filters = filters
+            self.updated = started
+            self.removed = removed.date if removed else started
+            self.removals = 0
+            self.builds += 1
+
+    def revalidate(self):
+        """
+        Adds hashes changed since the last refresh to the filters, rebuilding
+        them instead if they are missing, full or too stale.
+        """
+        if self.filters is None:
+            self.build()
+        else:
+            started = datetime.utcnow()
+            removals = Removal.objects(date__gt=self.removed).count()
+            stale = float(self.removals + removals) / max(
+                self.filters.values()[0].count, 1)
+            full = any(
+                f.count >= f.capacity for f in self.filters.values())
+            if stale > config.FINGERPRINT_FILTER_REBUILD_RATIO or full:
+                self.build()
+            else:
+                for item in self._fetch(self.updated):
+                    self._add(self.filters, item)
+                with self._lock:
+                    self.updated = started
+                    self.removed = started
+                    self.removals += removals
+
+    def might_contain(self, algorithm, fingerprint):
+        """
+        Returns False if the fingerprint is definitely not in the database.
+        As long as the filter has not been loaded everything might be.
+
+        :Parameters:
+           - `algorithm`: The fingerprinting algorithm.
+           - `fingerprint`: The combined hash to look for.
+        """
+        self.schedule()
+        filters = self.filters
+        if not self.enabled or filters is None or algorithm not in filters:
+            return True
+        self.lookups += 1
+        if _bytes(fingerprint) in filters[algorithm]:
+            return True
+        self.negatives += 1
+        return False
+
+    def record_miss(self):
+        """
+        Record a lookup the filter could not rule out that found nothing.
+        """
+        self.false_positives += 1
+
+    def metrics(self):
+        """
+        Size and accuracy of the filters as a dict.
+        """
+        filters = self.filters or {}
+        checked = self.negatives + self.false_positives
+        return {
+            'enabled': self.enabled,
+            'loaded': self.filters is not None,
+            'updated': self.updated,
+            'builds': self.builds,
+            'lookups': self.lookups,
+            'negatives': self.negatives,
+            'false_positives': self.false_positives,
+            'false_positive_rate': (
+                float(self.false_positives) / checked if checked else 0.0),
+            'removals': self.removals,
+            'filters': dict(
+                (algorithm, {
+                    'entries': f.count,
+                    'capacity': f.capacity,
+                    'size': f.size,
+                    'hashes': f.hashes,
+                    'false_positive_rate': f.false_positive_rate,
+                })
+                for (algorithm, f) in filters.items()
+            ),
+        }
+
+
+fingerprint_filter = FingerprintFilter(config.HASHING_ALGORITHMS)
@@ -0,0 +1,245 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+A durable job queue backed by the jobs collection.
+
+Jobs are claimed by workers using an atomic find and modify, which grants a
+lease on the job. Workers renew the lease (heartbeat) while running a job; a
+job whose lease expires, eg: as its worker died, is claimed again. Failed jobs
+are retried with an exponential backoff until JOBS_MAX_ATTEMPTS is reached.
+"""
+import json
+import signal
+from datetime import datetime, timedelta
+from hashlib import sha1
+from importlib import import_module
+from multiprocessing import Event, Process
+from socket import gethostname
+from threading import Thread, Event as ThreadEvent
+from traceback import format_exc
+from uuid import uuid4
+
+from os import getpid
+from pymongo.errors import DuplicateKeyError
+
+from victims.web import config
+from victims.web.handlers.task import TASKS
+from victims.web.models import Job
+
+
+def enqueue(name, *args, **kwargs):
+    """
+    Queue a run of the named task. An identical job that is still queued for
+    its first run is not queued again, which a unique index on the job key
+    guarantees across concurrent enqueues. Jobs waiting for a retry are not
+    taken into account.
+
+    :Parameters:
+       - `name`: The registered name of the task.
+       - `args`: The arguments to pass to the task.
+       - `kwargs`: Key word arguments to pass to the task.
+    """
+    now = datetime.utcnow()
+    key = sha1(json.dumps(
+        [name, list(args), kwargs], sort_keys=True, default=str)).hexdigest()
+    try:
+        Job._get_collection().update(
+            {'key': key},
+            {'$setOnInsert': {
+                'task': name, 'args': list(args), 'kwargs': kwargs,
+                'status': 'QUEUED', 'attempts': 0, 'available': now,
+                'created': now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # queued concurrently
+        pass
+
+
+def resolve(name):
+    """
+    Returns the task function registered under the given name, importing its
+    module if required.
+    """
+    if name not in TASKS:
+        import_module(name.rsplit('.', 1)[0])
+    return TASKS[name]
+
+
+def backoff(attempts):
+    """
+    The delay before retrying a job that failed the given number of times.
+    """
+    return timedelta(seconds=min(
+        config.JOBS_BACKOFF * 2 ** (attempts - 1), config.JOBS_BACKOFF_MAX))
+
+
+class Worker(object):
+    """
+    Claims and runs queued jobs one at a time.
+    """
+
+    def __init__(self, stop=None):
+        """
+        :Parameters:
+           - `stop`: An Event, the worker exits once it is set.
+        """
+        self.stop = stop or Event()
+        self.owner = '%s:%d:%s' % (gethostname(), getpid(), uuid4().hex[:8])
+        self.collection = Job._get_collection()
+
+    def _lease(self):
+        return datetime.utcnow() + timedelta(seconds=config.JOBS_LEASE)
+
+    def claim(self):
+        """
+        Atomically claim the next available job, None if there is none.
+        """
+        now = datetime.utcnow()
+        return self.collection.find_and_modify(
+            query={'$or': [
+                {'status': 'QUEUED', 'available': {'$lte': now}},
+                {'status': 'RUNNING', 'lease': {'$lt': now},
+                 'attempts': {'$lt': config.JOBS_MAX_ATTEMPTS}},
+            ]},
+            update={
+                '$set': {
+                    'status': 'RUNNING', 'owner': self.owner,
+                    'lease': self._lease()},
+                '$inc': {'attempts': 1},
+                # identical jobs may be queued again once this one started
+                '$unset': {'key': 1},
+            },
+            sort=[('available', 1)],
+            new=True
+        )
+
+    def expire(self):
+        """
+        Give up on jobs whose worker died on their last attempt.
+        """
+        now = datetime.utcnow()
+        self.collection.update(
+            {'status': 'RUNNING', 'lease': {'$lt': now},
+             'attempts': {'$gte': config.JOBS_MAX_ATTEMPTS}},
+            {'$set': {
+                'status': 'FAILED', 'finished': now,
+                'error': 'Lease expired'}},
+            multi=True
+        )
+
+    def _heartbeat(self, job, done):
+        interval = config.JOBS_LEASE / 3.0
+        while not done.wait(interval):
+            self.collection.update(
+                {'_id': job['_id'], 'owner': self.owner},
+                {'$set': {'lease': self._lease()}})
+
+    def _finish(self, job, **values):
+        self.collection.update(
+            {'_id': job['_id'], 'owner': self.owner},
+            {'$set': values, '$unset': {'lease': 1}})
+
+    def execute(self, job):
+        """
+        Run a claimed job, renewing its lease until it is done.
+        """
+        done = ThreadEvent()
+        heartbeat = Thread(target=self._heartbeat, args=(job, done))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            resolve(job['task'])(*job['args'], **job['kwargs'])
+        except Exception:
+            error = format_exc()
+            config.LOGGER.warn('Job %s (%s) failed: %s' % (
+                job['_id'], job['task'], error))
+            now = datetime.utcnow()
+            if job['attempts'] < config.JOBS_MAX_ATTEMPTS:
+                self._finish(
+                    job, status='QUEUED', error=error,
+                    available=now + backoff(job['attempts']))
+            else:
+                self._finish(job, status='FAILED', error=error, finished=now)
+            return False
+        finally:
+            done.set()
+        self._finish(job, status='DONE', finished=datetime.utcnow())
+        return True
+
+    def run_once(self):
+        """
+        Claim and run a single job. Returns False if there was none.
+        """
+        job = self.claim()
+        if job is None:
+            return False
+        self.execute(job)
+        return True
+
+    def run(self):
+        """
+        Run jobs until stopped.
+        """
+        from victims.web.application import app
+        with app.app_context():
+            while not self.stop.is_set():
+                try:
+                    self.expire()
+                    if not self.run_once():
+                        self.stop.wait(config.JOBS_POLL_INTERVAL)
+                except Exception as e:
+                    config.LOGGER.warn('Worker error: %s' % (e))
+                    self.stop.wait(config.JOBS_POLL_INTERVAL)
+
+
+def _work(stop):
+    # the parent takes care of signals, jobs in progress are finished
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    Worker(stop).run()
+
+
+def run_workers(concurrency=None):
+    """
+    Run the given number of worker processes until SIGINT or SIGTERM. Each
+    worker finishes the job at hand before exiting.
+    """
+    concurrency = concurrency or config.WORKER_CONCURRENCY
+    stop = Event()
+
+    def shutdown(signum, frame):
+        config.LOGGER.info('Stopping workers')
+        stop.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    workers = [None] * concurrency
+    while not stop.is_set():
+        # (re)start workers that are not running, eg: as they crashed
+        for (i, worker) in enumerate(workers):
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None:
+                config.LOGGER.warn('Worker %d exited (%s), restarting' % (
+                    worker.pid, worker.exitcode))
+            workers[i] = Process(target=_work, args=(stop,))
+            workers[i].start()
+        stop.wait(1)
+    for worker in workers:
+        worker.join()
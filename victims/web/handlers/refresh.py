@@ -0,0 +1,74 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Stale-while-revalidate state that is refreshed in a background thread.
+"""
+
+from threading import Lock, Thread
+from time import time
+
+from victims.web import config
+
+
+class BackgroundRefresh(object):
+    """
+    In-process state that is revalidated in a background thread, at most
+    every `interval` seconds, while the current state keeps being served.
+    Subclasses implement `revalidate`.
+    """
+    # used in log messages
+    name = 'state'
+
+    def __init__(self):
+        self.checked = 0
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return True
+
+    @property
+    def interval(self):
+        raise NotImplementedError
+
+    def revalidate(self):
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            self.revalidate()
+        except Exception as e:
+            config.LOGGER.warn('Could not refresh %s: %s' % (self.name, e))
+        finally:
+            self.checked = time()
+            self._thread = None
+
+    def schedule(self):
+        """
+        Revalidate in a background thread if it is due.
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        if time() - self.checked < self.interval:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
@@ -0,0 +1,91 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+MongoEngine backed sessions, expired by the database.
+"""
+
+from datetime import datetime
+
+from flask_mongoengine import MongoEngineSessionInterface
+
+
+class VSessionInterface(MongoEngineSessionInterface):
+    """
+    Session interface storing sessions in a collection with a TTL index on
+    their expiration, so that the database removes expired sessions instead
+    of the application having to reap them.
+    """
+
+    def __init__(self, db, collection='session'):
+        if not isinstance(collection, basestring):
+            raise ValueError('collection argument should be string or unicode')
+
+        class DBSession(db.Document):
+            sid = db.StringField(primary_key=True)
+            data = db.DictField()
+            expiration = db.DateTimeField()
+            meta = {
+                'allow_inheritance': False,
+                'collection': collection,
+                'index_background': True,
+                'indexes': [
+                    {'fields': ['expiration'], 'expireAfterSeconds': 0}
+                ]
+            }
+
+        self.cls = DBSession
+
+    def ensure_expiry(self):
+        """
+        Create the TTL index on the session expiration. An existing index
+        with a different expiry (eg: flask-mongoengine's default) is modified
+        in place.
+        """
+        # not using _get_collection() as that ensures the declared indexes,
+        # which fails if one with different options is already present
+        collection = self.cls._get_db()[self.cls._get_collection_name()]
+        for info in collection.index_information().values():
+            if info['key'] == [('expiration', 1)]:
+                if info.get('expireAfterSeconds') != 0:
+                    collection.database.command(
+                        'collMod', collection.name,
+                        index={
+                            'keyPattern': {'expiration': 1},
+                            'expireAfterSeconds': 0
+                        })
+                return
+        collection.ensure_index(
+            'expiration', expireAfterSeconds=0, background=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        if not session:
+            if session.modified:
+                response.delete_cookie(app.session_cookie_name, domain=domain)
+            return
+
+        # expiration is compared in utc by both the ttl index and on open
+        expiration = datetime.utcnow() + \
+            self.get_expiration_time(app, session)
+
+        if session.modified:
+            self.cls(
+                sid=session.sid, data=session, expiration=expiration).save()
+
+        response.set_cookie(
+            app.session_cookie_name, session.sid, expires=expiration,
+            httponly=True, domain=domain)
@@ -17,81 +17,165 @@
 """
 An asynchronous task manager.
 
-This is a simple implementation for background task handing. No guarentees are
-provided for task execution.
+This is a simple implementation for background task handing. Tasks are run by
+a fixed size pool of threads. No guarentees are provided for task execution.
 """
 
-from multiprocessing import Process
-from threading import Thread
-from Queue import Queue
+from Queue import Queue, Full
+from threading import Lock, Thread
 
+from os import getpid
 
-class TaskException(Exception):
-    pass
-
-
-class Waiter(Thread):
-    """
-    Waiter thread
-    """
-    def __init__(self):
-        self.__q = Queue()
-        self.__stopped = False
-
-    @property
-    def stopped(self):
-        return self.__stopped
+from victims.web import config
 
-    def run(self):
-        while True:
-            child = self.__q.get()
-            if child is None:
-                return
-            child.join()
-
-    def waiton(self, process):
-        self.__q.put(process)
 
-    def stop(self):
-        self.__q.put(None)
-        self.__stopped = True
+class TaskException(Exception):
+    pass
 
 
 class TaskManager():
     """
     Task Manager implementation. This class allows for any function to be fired
-    as their own process. Once fired the parent procsses can continue on doing
-    their business.
+    in the background. Once fired the caller can continue on doing its
+    business.
+
+    Tasks are run by a pool of `workers` threads, each inside an application
+    context. Adding a task identical (same function and arguments) to one that
+    is still waiting to be run is a no-op.
+    At most `limit` tasks wait to be run; when the queue is full the task is
+    either dropped (policy 'drop') or run by the caller (policy 'caller').
 
     We do not guarentee execution of success of process.
     """
-    def __init__(self):
-        self._waiter = Waiter()
-
-    def __del__(self):
-        self._waiter.stop()
+    POLICIES = ['drop', 'caller']
+
+    def __init__(self, workers=None, limit=None, policy=None):
+        self.workers = workers or config.TASK_WORKERS
+        self.limit = limit or config.TASK_QUEUE_LIMIT
+        self.policy = policy or config.TASK_OVERFLOW_POLICY
+        if self.policy not in self.POLICIES:
+            raise TaskException('Unknown overflow policy %s' % (self.policy))
+        self._lock = Lock()
+        self._stopped = False
+        self._pid = None
+        self._pending = set()
+        self.counters = dict(
+            (counter, 0) for counter in [
+                'queued', 'running', 'completed', 'failed', 'dropped',
+                'deduplicated'])
+
+    def _start(self):
+        """
+        Start the pool, again if this is a forked child of the process that
+        started it.
+        """
+        if self._pid == getpid():
+            return
+        self._pid = getpid()
+        self._queue = Queue(self.limit)
+        self._pending = set()
+        self.counters['queued'] = self.counters['running'] = 0
+        for _ in range(self.workers):
+            thread = Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def _count(self, counter, delta=1):
+        with self._lock:
+            self.counters[counter] += delta
+
+    def _run(self, fn, args, kwargs):
+        self._count('running')
+        try:
+            fn(*args, **kwargs)
+            self._count('completed')
+        except Exception as e:
+            self._count('failed')
+            config.LOGGER.warn('Task %s failed: %s' % (fn, e))
+        finally:
+            self._count('running', -1)
+
+    def _work(self):
+        # Tasks may use current_app or the cache, run them in a context
+        from victims.web.application import app
+        queue = self._queue
+        while True:
+            (key, fn, args, kwargs) = queue.get()
+            with self._lock:
+                self._pending.discard(key)
+                self.counters['queued'] -= 1
+            with app.app_context():
+                self._run(fn, args, kwargs)
 
     def add_task(self, fn, *args, **kwargs):
         """
-        If the kitchen is still accepting orders place task on waiter's docket.
+        If the kitchen is still accepting orders place task on the queue.
         Else, a TaskException is raised.
 
+        Returns True if the task was queued (or run due to the overflow
+        policy), False if it was dropped or is already waiting to be run.
+
         :Parameters:
-            `fn`: Target function to run as a seperate Process
+            `fn`: Target function to run in the background
             `args`: The arguments to pass to the target function
             `kwargs`: Key word arguments to pass to the target function
         """
-        if self._waiter.stopped:
+        if self._stopped:
             raise TaskException('We are close for business. Go elsewhere!')
-        process = Process(target=fn, args=args, kwargs=kwargs)
-        process.start()
-        self._waiter.waiton(process)
+
+        key = (fn, repr(args), repr(sorted(kwargs.items())))
+        with self._lock:
+            self._start()
+            if key in self._pending:
+                self.counters['deduplicated'] += 1
+                return False
+            try:
+                self._queue.put_nowait((key, fn, args, kwargs))
+            except Full:
+                if self.policy == 'drop':
+                    self.counters['dropped'] += 1
+                    config.LOGGER.warn('Task queue full, dropped %s' % (fn))
+                    return False
+            else:
+                self._pending.add(key)
+                self.counters['queued'] += 1
+                return True
+
+        # overflow policy 'caller', run outside of the lock
+        self._run(fn, args, kwargs)
+        return True
+
+    def stop(self):
+        """
+        Stop accepting tasks, queued tasks are still run.
+        """
+        self._stopped = True
 
 
 taskman = TaskManager()
 
 
+# All functions decorated with task, by their fully qualified name
+TASKS = {}
+
+
 def task(f):
+    """
+    Decorator making calls to the function run in the background. Depending
+    on TASK_BACKEND the call is run by the task manager ('local') or queued
+    for a worker ('queue'), in which case all arguments have to be BSON
+    serializable.
+    """
+    name = '%s.%s' % (f.__module__, f.__name__)
+    TASKS[name] = f
+
     def wrapper(*args, **kwargs):
-        taskman.add_task(f, *args, **kwargs)
+        if config.TASK_BACKEND == 'queue':
+            from victims.web.handlers.queue import enqueue
+            enqueue(name, *args, **kwargs)
+        else:
+            taskman.add_task(f, *args, **kwargs)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    wrapper.task_name = name
     return wrapper
@@ -0,0 +1,173 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Index maintenance. Builds the indexes declared on the models and reports on
+the state of the indexes present in the database.
+"""
+from pymongo.errors import OperationFailure
+
+from victims.web.config import API_FEED_BATCH_SIZE, API_UPDATES_DEFAULT_FIELDS
+from victims.web.keywords import keywords
+from victims.web.models import Hash, MODELS, feed_signature
+from victims.web.versions import version_key
+
+
+def _key(fields):
+    return tuple((str(name), int(direction)) for (name, direction) in fields)
+
+
+def index_usage(collection):
+    """
+    Number of operations that used each index of a collection, keyed by index
+    name. Returns None if the server does not keep index usage statistics.
+
+    :Parameters:
+       - `collection`: The pymongo collection.
+    """
+    try:
+        result = collection.database.command(
+            'aggregate', collection.name, pipeline=[{'$indexStats': {}}],
+            cursor={})
+    except OperationFailure:
+        # $indexStats was added in MongoDB 3.2
+        return None
+    if 'cursor' in result:
+        stats = result['cursor']['firstBatch']
+    else:
+        stats = result.get('result', [])
+    return dict(
+        (stat['name'], stat['accesses']['ops']) for stat in stats)
+
+
+def index_report(model):
+    """
+    Compare the indexes declared on a model with the ones in its collection.
+
+    Returns a dict with the key specs of the declared indexes that are
+    `missing`, the names of the indexes not declared by the model
+    (`undeclared`) and the names of the indexes that have not been used
+    since the server started (`unused`, None if unknown).
+
+    :Parameters:
+       - `model`: The document class to report on.
+    """
+    # not using _get_collection() as that already ensures the indexes
+    collection = model._get_db()[model._get_collection_name()]
+    existing = collection.index_information()
+    keys = set(_key(info['key']) for info in existing.values())
+    declared = [_key(spec['fields']) for spec in model._meta['index_specs']]
+
+    usage = index_usage(collection)
+    unused = None
+    if usage is not None:
+        unused = sorted(
+            name for (name, ops) in usage.items()
+            if ops == 0 and name != '_id_')
+
+    return {
+        'missing': [key for key in declared if key not in keys],
+        'undeclared': sorted(
+            name for (name, info) in existing.items()
+            if name != '_id_' and _key(info['key']) not in declared),
+        'unused': unused,
+    }
+
+
+def ensure_indexes(models=MODELS):
+    """
+    Build all declared indexes, in the background, and report on the result.
+    Returns a dict of reports (see `index_report`) keyed by collection name.
+
+    :Parameters:
+       - `models`: The document classes to ensure the indexes of.
+    """
+    reports = {}
+    for model in models:
+        report = index_report(model)
+        model.ensure_indexes()
+        report['built'] = report['missing']
+        report['missing'] = index_report(model)['missing']
+        reports[model._get_collection_name()] = report
+    return reports
+
+
+def reindex_versions():
+    """
+    Recompute the sortable version keys of all hashes, eg: after upgrading or
+    changing VERSION_SCHEMES. The hashes' dates are left untouched so that
+    clients are not sent the hashes again. Returns the number of hashes
+    updated.
+    """
+    collection = Hash._get_collection()
+    items = collection.find(
+        {}, ['group', 'coordinates.version', '_version_key'])
+    updated = 0
+    for item in items.batch_size(API_FEED_BATCH_SIZE):
+        try:
+            key = version_key(
+                item.get('group'),
+                (item.get('coordinates') or {}).get('version'))
+        except ValueError:
+            key = None
+        if key != item.get('_version_key'):
+            collection.update(
+                {'_id': item['_id']}, {'$set': {'_version_key': key}})
+            updated += 1
+    return updated
+
+
+def reindex_keywords():
+    """
+    Recompute the search keywords of all hashes, eg: after upgrading or
+    changing SEARCH_KEYWORD_LENGTH. The hashes' dates are left untouched.
+    Returns the number of hashes updated.
+    """
+    collection = Hash._get_collection()
+    items = collection.find(
+        {}, ['name', 'cves.id', 'coordinates', '_keywords'])
+    updated = 0
+    for item in items.batch_size(API_FEED_BATCH_SIZE):
+        values = [item.get('name')]
+        values.extend(cve.get('id') for cve in item.get('cves') or [])
+        values.extend((item.get('coordinates') or {}).values())
+        found = keywords(values)
+        if found != item.get('_keywords'):
+            collection.update(
+                {'_id': item['_id']}, {'$set': {'_keywords': found}})
+            updated += 1
+    return updated
+
+
+def render_feeds():
+    """
+    Render the stored feed json of all hashes that have none or one rendered
+    with different fields, eg: after changing API_UPDATES_DEFAULT_FIELDS.
+    Returns the number of hashes updated.
+    """
+    fields = API_UPDATES_DEFAULT_FIELDS
+    signature = feed_signature(fields)
+    serializer = Hash.serializer(fields)
+    collection = Hash._get_collection()
+    items = Hash.objects(_feed__fields__ne=signature).only(*fields)._cursor
+    updated = 0
+    for item in items.batch_size(API_FEED_BATCH_SIZE):
+        collection.update(
+            {'_id': item['_id']},
+            {'$set': {'_feed': {
+                'fields': signature, 'json': serializer.dumps(item)}}})
+        updated += 1
+    return updated
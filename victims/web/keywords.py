@@ -0,0 +1,84 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Search keywords.
+
+Searchable values (names, CVE ids and coordinates) are broken down into
+keywords that are stored with each hash. A keyword is a lower case prefix of
+a value or of one of its alphanumeric tokens, so that a search term that
+starts a value or a token is looked up as a single equality match on the
+keywords index. Keywords are capped at SEARCH_KEYWORD_LENGTH characters.
+
+For example `commons-io` yields `co`, `com` ... `commons-io`, `io` and the
+prefixes of `commons`.
+"""
+import re
+
+from victims.web import config
+
+_TOKEN_RE = re.compile('[0-9a-z]+')
+
+# shorter terms match too many entries to be of use
+MIN_LENGTH = 2
+
+
+def _prefixes(value, found):
+    # each keyword is capped, not the value, so later tokens are still found
+    end = min(len(value), config.SEARCH_KEYWORD_LENGTH)
+    for length in range(MIN_LENGTH, end + 1):
+        found.add(value[:length])
+
+
+def normalize(value):
+    """
+    The form in which a value is tokenized.
+    """
+    return value.strip().lower()
+
+
+def keywords(values):
+    """
+    The sorted keywords of the given values.
+
+    :Parameters:
+       - `values`: The searchable values, anything but strings is skipped.
+    """
+    found = set()
+    for value in values:
+        if not isinstance(value, basestring):
+            continue
+        value = normalize(value)
+        _prefixes(value, found)
+        for token in _TOKEN_RE.findall(value):
+            _prefixes(token, found)
+    return sorted(found)
+
+
+def terms(query):
+    """
+    The keywords a search query has to match, one per whitespace separated
+    term. Terms that are too short are left out.
+
+    :Parameters:
+       - `query`: The search query.
+    """
+    found = []
+    for term in query.split():
+        term = normalize(term)[:config.SEARCH_KEYWORD_LENGTH]
+        if len(term) >= MIN_LENGTH and term not in found:
+            found.append(term)
+    return found
@@ -20,6 +20,7 @@ Data models.
 
 import datetime
 import json
+from collections import OrderedDict
 from copy import deepcopy
 from hashlib import sha1
 from hmac import HMAC
@@ -31,14 +32,20 @@ from flask_bcrypt import generate_password_hash
 from flask_mongoengine import Document
 from mongoengine import (
     StringField, DateTimeField, DictField, BooleanField, EmbeddedDocument,
-    EmbeddedDocumentField, ListField, EmailField
+    EmbeddedDocumentField, ListField, EmailField, IntField, ReferenceField,
+    GenericReferenceField
 )
 from os import urandom, remove
-from os.path import isfile
+from os.path import isfile, join
+from threading import Lock
 
 from victims.web.config import (
-    BCRYPT_LOG_ROUNDS, SUBMISSION_GROUPS, HASHING_ALGORITHMS
+    BCRYPT_LOG_ROUNDS, SUBMISSION_GROUPS, HASHING_ALGORITHMS, SNAPSHOT_FOLDER,
+    REMOVALS_RETENTION, USERNAME_CACHE_SIZE, API_UPDATES_DEFAULT_FIELDS,
+    API_FEED_BATCH_SIZE, JOBS_RETENTION
 )
+from victims.web.keywords import keywords
+from victims.web.versions import version_key
 
 
 def generate_client_secret(apikey):
@@ -72,6 +79,31 @@ def group_coordinates():
     return keys
 
 
+def hash_indexes():
+    """
+    Indexes backing the hash lookups; one per fingerprinting algorithm and
+    one per group on the coordinates of that group.
+    """
+    indexes = [
+        {'fields': ['hashes.%s.combined' % (alg)], 'sparse': True}
+        for alg in HASHING_ALGORITHMS
+    ]
+    for group in sorted(SUBMISSION_GROUPS.keys()):
+        keys = ['coordinates.%s' % (key) for key in SUBMISSION_GROUPS[group]]
+        indexes.append(tuple(['group'] + keys))
+        # version range scans within an artifact
+        keys = [key for key in keys if key != 'coordinates.version']
+        indexes.append(tuple(['group'] + keys + ['_version_key']))
+    return indexes
+
+
+def snapshot_marker(group):
+    """
+    Path of the file flagging the snapshot of a group as out of date.
+    """
+    return join(SNAPSHOT_FOLDER, '%s.dirty' % (group))
+
+
 class RestrictedDict(dict):
     __metaclass__ = ABCMeta
 
@@ -112,35 +144,240 @@ class ValidatedDocument(Document):
         super(ValidatedDocument, self).save(*args, **kwargs)
 
 
-class JsonifyMixin(object):
+# Usernames of accounts referenced by serialized documents, least recently
+# used first. Shared by all requests of a worker.
+_USERNAMES = OrderedDict()
+_USERNAMES_LOCK = Lock()
 
-    def jsonify(self, fields=None):
+
+def _remember_username(account_id, username):
+    with _USERNAMES_LOCK:
+        _USERNAMES.pop(account_id, None)
+        _USERNAMES[account_id] = username
+        while len(_USERNAMES) > USERNAME_CACHE_SIZE:
+            _USERNAMES.popitem(last=False)
+
+
+def forget_username(account_id):
+    """
+    Drop a cached username, eg: when the account changes.
+    """
+    with _USERNAMES_LOCK:
+        _USERNAMES.pop(account_id, None)
+
+
+def resolve_usernames(account_ids):
+    """
+    Returns a dict of account id to username for the given ids. Ids not
+    already cached are resolved using a single query.
+
+    :Parameters:
+       - `account_ids`: An iterable of account ids.
+    """
+    usernames = {}
+    missing = set()
+    with _USERNAMES_LOCK:
+        for account_id in account_ids:
+            if account_id in _USERNAMES:
+                # move to the most recently used end
+                usernames[account_id] = _USERNAMES.pop(account_id)
+                _USERNAMES[account_id] = usernames[account_id]
+            else:
+                missing.add(account_id)
+
+    if missing:
+        accounts = Account._get_collection().find(
+            {'_id': {'$in': list(missing)}}, ['username'])
+        for account in accounts:
+            username = str(account['username'])
+            usernames[account['_id']] = username
+            _remember_username(account['_id'], username)
+    return usernames
+
+
+def collect_dbrefs(obj, refs=None):
+    """
+    Returns the set of ids of all DBRefs found in (nested) dicts and lists.
+    """
+    if refs is None:
+        refs = set()
+    if isinstance(obj, DBRef):
+        refs.add(obj.id)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            collect_dbrefs(value, refs)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            collect_dbrefs(value, refs)
+    return refs
+
+
+def prefetch_dbrefs(items, fields=None):
+    """
+    Resolve all DBRefs in a batch of documents (as dicts) up front so that
+    serializing them does not query for each reference.
+
+    :Parameters:
+       - `items`: The documents to resolve the references of.
+       - `fields`: Only look for references in these (top-level) fields,
+         None to look everywhere.
+    """
+    refs = set()
+    for item in items:
+        if fields is None:
+            collect_dbrefs(item, refs)
+        else:
+            for field in fields:
+                collect_dbrefs(item.get(field), refs)
+    if refs:
+        resolve_usernames(refs)
+
+
+def handle_special_objs(obj):
+    """
+    Serialization hook for objects json (or any other encoder) cannot handle.
+    """
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    elif isinstance(obj, DBRef):
+        username = resolve_usernames([obj.id]).get(obj.id)
+        if username is None:
+            raise Account.DoesNotExist(
+                'Referenced account %s not found' % (obj.id))
+        return username
+    return str(obj)
+
+
+class Serializer(object):
+    """
+    Serializes documents as stored in the database (eg: raw pymongo results)
+    of a model, reducing them to the public fields given when compiled.
+    """
+
+    def __init__(self, keys, converters):
         """
-        Converts an instance into json.
+        :Parameters:
+           - `keys`: The database names of the keys to keep, None to keep
+             all keys not starting with an underscore.
+           - `converters`: A dict of key to function converting its value.
+        """
+        self.keys = keys
+        self.converters = converters
+
+    def __call__(self, data):
+        """
+        Returns a new dict with the public fields of the given document.
+        """
+        keys = self.keys
+        converters = self.converters
+        result = {}
+        for (key, value) in data.iteritems():
+            if keys is None:
+                if key.startswith('_'):
+                    continue
+            elif key not in keys:
+                continue
+            if key in converters:
+                value = converters[key](value)
+            result[key] = value
+        return result
+
+    def dumps(self, data):
+        """
+        Serializes the given document to json.
         """
+        return json.dumps(self(data), default=handle_special_objs)
+
 
-        def handle_special_objs(obj):
-            if hasattr(obj, 'isoformat'):
-                return obj.isoformat()
-            elif isinstance(obj, DBRef):
-                return str(Account.objects.get(id=obj.id).username)
-            return str(obj)
+# Compiled serializers keyed by model and fields. Bounded as fields can be
+# requested by clients.
+_SERIALIZERS = {}
+_SERIALIZER_CACHE_SIZE = 256
+
+
+class JsonifyMixin(object):
 
-        data = self.to_mongo()
+    # json name to function converting the value when serializing
+    _serialize_converters = {}
 
-        # workaround to remove default values when using only(*fields)
-        # Note that this will not work for embedded documents with defaults
+    @classmethod
+    def serializer(cls, fields=None):
+        """
+        Returns the (cached) serializer for the given fields of this model.
+        Nested fields (eg: hashes.sha512) select their top-level field.
+        """
+        keys = None
         if fields:
-            fields = [
-                self.jsonname(f.split('.', 1)[0].strip()) for f in fields
-            ]
+            public = set(cls._reverse_db_field_map.keys())
+            keys = frozenset(
+                key for key in (
+                    cls.jsonname(f.split('.', 1)[0].strip()) for f in fields
+                ) if key in public and not key.startswith('_')
+            )
+
+        cache_key = (cls, keys)
+        serializer = _SERIALIZERS.get(cache_key)
+        if serializer is None:
+            if len(_SERIALIZERS) >= _SERIALIZER_CACHE_SIZE:
+                _SERIALIZERS.clear()
+            serializer = Serializer(keys, cls._serialize_converters)
+            _SERIALIZERS[cache_key] = serializer
+        return serializer
+
+    @classmethod
+    def reference_fields(cls):
+        """
+        The (stored) names of the fields of this model that can hold DBRefs.
+        """
+        references = (ReferenceField, GenericReferenceField)
+        return [
+            field.db_field for field in cls._fields.values()
+            if isinstance(field, references) or
+            isinstance(getattr(field, 'field', None), references)
+        ]
+
+    @classmethod
+    def serialize_son(cls, data, fields=None):
+        """
+        Reduces a document as stored in the database (eg: a raw pymongo
+        result) to its (given) public fields. Values are kept as is, use
+        handle_special_objs to encode the ones that are not natively supported
+        by an encoder.
+        """
+        return cls.serializer(fields)(data)
+
+    @classmethod
+    def project(cls, data, fields):
+        """
+        Reduces a document as stored in the database to the given (nested)
+        fields, like a MongoDB projection would.
+        """
+        projected = {}
+        for field in fields:
+            parts = field.strip().split('.')
+            parts[0] = cls.jsonname(parts[0])
+            (source, target) = (data, projected)
+            for part in parts[:-1]:
+                if not isinstance(source, dict) or part not in source:
+                    break
+                source = source[part]
+                target = target.setdefault(part, {})
+            else:
+                if isinstance(source, dict) and parts[-1] in source:
+                    target[parts[-1]] = source[parts[-1]]
+        return projected
 
-        for key in data.keys():
-            if key.startswith('_') or (fields and key not in fields):
-                if key in data:
-                    del data[key]
+    def serialize(self, fields=None):
+        """
+        Converts an instance into a dictionary of the (given) public fields.
+        """
+        return self.serializer(fields)(self.to_mongo())
 
-        return json.dumps(data, default=handle_special_objs)
+    def jsonify(self, fields=None):
+        """
+        Converts an instance into json.
+        """
+        return self.serializer(fields).dumps(self.to_mongo())
 
     def mongify(self, data):
         """
@@ -175,11 +412,7 @@ class JsonifyMixin(object):
         Convert JSON fieldname (DB name) to Model fieldname. If no match found,
         the input fieldname is retured.
         """
-        if injson in cls._db_field_map.values():
-            for field in cls._db_field_map.keys():
-                if injson == cls._db_field_map[field]:
-                    return field
-        return injson
+        return cls._reverse_db_field_map.get(injson, injson)
 
     @classmethod
     def jsonname(cls, inmodel):
@@ -201,7 +434,14 @@ class Account(ValidatedDocument):
     """
     A user account.
     """
-    meta = {'collection': 'users'}
+    meta = {
+        'collection': 'users',
+        'index_background': True,
+        'indexes': [
+            'username',
+            'apikey',
+        ]
+    }
 
     username = StringField(regex='^[a-zA-Z0-9_\-\.]*$', required=True)
     password = StringField(required=True)
@@ -235,13 +475,151 @@ class Account(ValidatedDocument):
         if self.apikey is None or len(self.apikey) == 0:
             self.update_api_tokens()
         ValidatedDocument.save(self, *args, **kwargs)
+        forget_username(self.pk)
+
+
+class GroupState(Document):
+    """
+    State of a group shared between all instances of the application.
+    """
+    meta = {'collection': 'groupstate'}
+
+    group = StringField(primary_key=True)
+    # high-water marks of the hashes and removals in this group
+    updated = DateTimeField()
+    removed = DateTimeField()
+    # removals up to this date may have been expired
+    horizon = DateTimeField()
+    # number of documents in each counted state, see CountedMixin
+    counts = DictField(default={})
+    # when the counts were last recounted in full
+    counted = DateTimeField()
+    # incremented on every change of the counts
+    version = IntField(default=0)
+
+    @classmethod
+    def mark(cls, group, **marks):
+        """
+        Atomically advance the given marks of a group, creating the state if
+        required. A mark is never moved back, so racing or late saves can not
+        make a watermark repeat an earlier value.
+
+        :Parameters:
+           - `group`: The group to update.
+           - `marks`: Field names and their new values.
+        """
+        if not group:
+            return
+        collection = cls._get_collection()
+        for (field, value) in marks.items():
+            advance = {
+                '_id': group,
+                '$or': [{field: {'$lt': value}}, {field: None}]
+            }
+            if collection.update(advance, {'$set': {field: value}})['n']:
+                continue
+            created = collection.update(
+                {'_id': group}, {'$setOnInsert': {field: value}},
+                upsert=True)
+            if created['updatedExisting']:
+                # the state exists, possibly created meanwhile with an
+                # earlier mark
+                collection.update(advance, {'$set': {field: value}})
+
+    @classmethod
+    def count(cls, before, after):
+        """
+        Atomically move a document from one counter to another. Each counter
+        is a (group, name) tuple, or None if not counted.
+
+        :Parameters:
+           - `before`: The counter the document was counted in.
+           - `after`: The counter the document is now counted in.
+        """
+        if before == after:
+            return
+        collection = cls._get_collection()
+        for (counter, delta) in [(before, -1), (after, 1)]:
+            if counter is not None:
+                (group, name) = counter
+                collection.update(
+                    {'_id': group},
+                    {'$inc': {'counts.%s' % (name): delta, 'version': 1}},
+                    upsert=True)
+
+    @classmethod
+    def stamp(cls):
+        """
+        A version stamp of the counts of all groups. It changes whenever any
+        of the counts do.
+        """
+        return sum(
+            state.get('version', 0)
+            for state in cls._get_collection().find({}, {'version': True}))
+
+
+class CountedMixin(object):
+    """
+    Keeps the GroupState counts of documents in each state up to date. The
+    state is held in the `_counted_field` and `_counters` maps the counted
+    states to the name of their counter. The counter a stored document was
+    last counted in is recorded in its `_counted_key` so that moving it is
+    conditional on what was counted, not on what was read before saving.
+    """
+    _counted_field = None
+    _counted_key = '_counted'
+    _counters = {}
+
+    def _counter(self, group, state):
+        name = self._counters.get(state)
+        if group and name:
+            return (group, name)
+        return None
+
+    def counter(self):
+        """
+        The counter this document is counted in, None if not counted.
+        """
+        return self._counter(self.group, getattr(self, self._counted_field))
+
+    def move_counter(self, counter):
+        """
+        Atomically record the counter the stored document is counted in and
+        move it there from the counter previously recorded. Concurrent saves
+        or deletes of the same document therefore move it only once.
+
+        :Parameters:
+           - `counter`: The counter to count the document in, None to stop
+             counting it (before a delete).
+        """
+        if self.pk is None:
+            return
+        key = self._counted_key
+        if counter is None:
+            update = {'$unset': {key: True}}
+        else:
+            update = {'$set': {key: list(counter)}}
+        previous = self._get_collection().find_and_modify(
+            {'_id': self.pk}, update, fields={key: True})
+        if previous is not None and previous.get(key):
+            previous = tuple(previous[key])
+        else:
+            previous = None
+        GroupState.count(previous, counter)
 
 
 class Removal(JsonifyMixin, ValidatedDocument):
     """
     A removal entry
     """
-    meta = {'collection': 'removals'}
+    meta = {
+        'collection': 'removals',
+        'index_background': True,
+        'indexes': [
+            ('group', 'date'),
+            ('group', 'hash', '-date'),
+        ]
+    }
 
     date = DateTimeField(default=datetime.datetime.utcnow)
     hash = StringField(regex='^[a-fA-F0-9]*$')
@@ -255,6 +633,63 @@ class Removal(JsonifyMixin, ValidatedDocument):
         default='DELETE'
     )
 
+    def save(self, *args, **kwargs):
+        ValidatedDocument.save(self, *args, **kwargs)
+        GroupState.mark(self.group, removed=self.date)
+
+    @classmethod
+    def compact(cls, retention=REMOVALS_RETENTION, batch=1000):
+        """
+        Collapse the removals of each (group, hash) to the latest one and
+        expire removals older than the retention period. The latest date
+        expired in a group is recorded as its horizon; clients that synced
+        before it have to resync.
+
+        Returns a tuple of the number of collapsed and expired removals.
+
+        :Parameters:
+           - `retention`: A timedelta, removals older than this are expired.
+             None to keep all removals.
+           - `batch`: The number of removals to delete at a time.
+        """
+        collection = cls._get_collection()
+
+        def delete(ids):
+            collection.remove({'_id': {'$in': ids}})
+            return len(ids)
+
+        # only the latest removal of a hash is relevant to any client, as
+        # its date is after any since the earlier ones would be sent for
+        collapsed = 0
+        duplicates = []
+        previous = None
+        items = collection.find({}, ['group', 'hash', 'date']).sort(
+            [('group', 1), ('hash', 1), ('date', -1)])
+        for item in items.batch_size(batch):
+            current = (item.get('group'), item.get('hash'))
+            if current == previous:
+                duplicates.append(item['_id'])
+                if len(duplicates) >= batch:
+                    collapsed += delete(duplicates)
+                    duplicates = []
+            previous = current
+        if duplicates:
+            collapsed += delete(duplicates)
+
+        expired = 0
+        if retention is not None:
+            cutoff = datetime.datetime.utcnow() - retention
+            for group in SUBMISSION_GROUPS.keys():
+                items = cls.objects(group=group, date__lt=cutoff)
+                latest = items.order_by('-date').only('date').first()
+                if latest is None:
+                    continue
+                # move the horizon first, no client may miss a removal
+                GroupState.mark(group, horizon=latest.date)
+                expired += items.count()
+                items.delete()
+        return (collapsed, expired)
+
 
 class CVE(JsonifyMixin, EmbeddedDocument):
     """
@@ -306,14 +741,49 @@ class HashesDict(RestrictedDict):
         return HASHING_ALGORITHMS
 
 
-class Hash(JsonifyMixin, EmbeddedDocument, ValidatedDocument):
+def feed_signature(fields):
+    """
+    Identifies the fields a stored feed fragment was rendered with.
+    """
+    return ','.join(fields)
+
+
+def cve_ids(cves):
+    """
+    Flatten a list of CVE records into their ids.
+    """
+    return [cve['id'] if isinstance(cve, dict) else cve for cve in cves]
+
+
+class Hash(JsonifyMixin, CountedMixin, EmbeddedDocument, ValidatedDocument):
     """
     A hash record.
     """
-    meta = {'collection': 'hashes'}
+    meta = {
+        'collection': 'hashes',
+        'index_background': True,
+        'indexes': [
+            ('group', 'date', 'id'),
+            # browsing released hashes, see ui.hashes
+            ('status', 'group', 'name', 'id'),
+            ('status', 'group', 'date', 'id'),
+            # searching released hashes, see victims.web.keywords
+            ('status', '_keywords', 'id'),
+        ] + hash_indexes()
+    }
+
+    _serialize_converters = {'cves': cve_ids}
+    _counted_field = 'status'
+    _counters = {'RELEASED': 'hashes'}
 
     # Temporary item for v1 mapping
     _v1 = DictField(default={})
+    # sortable key of the version coordinate, see victims.web.versions
+    _version_key = StringField()
+    # pre-rendered json of the default feed fields, see render_feed
+    _feed = DictField(default=None)
+    # search keywords, see victims.web.keywords
+    _keywords = ListField(StringField(), default=[])
     date = DateTimeField(default=datetime.datetime.utcnow)
     createdon = DateTimeField(default=datetime.datetime.utcnow)
     hash = StringField(regex='^[a-fA-F0-9]*$')
@@ -350,13 +820,6 @@ class Hash(JsonifyMixin, EmbeddedDocument, ValidatedDocument):
             if cve not in cvelist:
                 self.cves.append(CVE(id=cve))
 
-    def jsonify(self, fields=None):
-        """
-        Update jsonify to flatten some fields.
-        """
-        self.cves = self.cve_list()
-        return JsonifyMixin.jsonify(self, fields)
-
     def mongify(self, data):
         """
         Load from json
@@ -374,27 +837,147 @@ class Hash(JsonifyMixin, EmbeddedDocument, ValidatedDocument):
             removal = Removal(hash=self.hash, group=self.group, reason=reason)
             removal.save()
 
+    def update_version_key(self):
+        """
+        Update the sortable key of the version coordinate. Versions that can
+        not be parsed are left out of version range queries.
+        """
+        try:
+            self._version_key = version_key(
+                self.group, (self.coordinates or {}).get('version'))
+        except ValueError:
+            self._version_key = None
+
+    def update_keywords(self):
+        """
+        Update the search keywords of the name, CVEs and coordinates.
+        """
+        self._keywords = keywords(
+            [self.name] + self.cve_list() +
+            (self.coordinates or {}).values())
+
+    @classmethod
+    def search(cls, terms, groups=None):
+        """
+        Released hashes matching all the given keywords, ordered by id.
+
+        :Parameters:
+           - `terms`: The keywords to match, see victims.web.keywords.terms.
+           - `groups`: The groups to restrict the search to.
+        """
+        # the first term is looked up on the index, the longest one is
+        # likely the most selective
+        terms = sorted(terms, key=len, reverse=True)
+        items = cls.objects(status='RELEASED', _keywords__all=terms)
+        if groups is not None:
+            items = items.filter(group__in=groups)
+        return items.order_by('id')
+
+    def render_feed(self):
+        """
+        Render the json of the default feed fields (API_UPDATES_DEFAULT_FIELDS)
+        so that it need not be serialized again for every feed request.
+        """
+        fields = API_UPDATES_DEFAULT_FIELDS
+        self._feed = {
+            'fields': feed_signature(fields),
+            'json': self.serializer(fields).dumps(
+                self.project(self.to_mongo(), fields)),
+        }
+
+    @classmethod
+    def rendered(cls, items, fields=API_UPDATES_DEFAULT_FIELDS,
+                 batch=API_FEED_BATCH_SIZE):
+        """
+        Generator yielding the json of the given fields for each item of a
+        queryset. The json stored by render_feed is used as is, items without
+        (an up to date) one are serialized in batches.
+
+        :Parameters:
+           - `items`: A queryset of hashes.
+           - `fields`: The fields to render.
+           - `batch`: The number of items to fetch at a time.
+        """
+        signature = feed_signature(fields)
+        serializer = cls.serializer(fields)
+
+        def flush(rows):
+            stale = set(
+                row['_id'] for row in rows
+                if (row.get('_feed') or {}).get('fields') != signature
+            )
+            if stale:
+                fallback = cls.objects(id__in=list(stale)).only(
+                    *fields)._cursor
+                rendered = dict(
+                    (row['_id'], serializer.dumps(row)) for row in fallback)
+            for row in rows:
+                if row['_id'] in stale:
+                    # gone since the first query
+                    if row['_id'] in rendered:
+                        yield rendered[row['_id']]
+                else:
+                    yield row['_feed']['json']
+
+        rows = []
+        for row in items.only('_feed')._cursor.batch_size(batch):
+            rows.append(row)
+            if len(rows) >= batch:
+                for json_string in flush(rows):
+                    yield json_string
+                rows = []
+        for json_string in flush(rows):
+            yield json_string
+
+    def mark_dirty(self):
+        """
+        Flag the snapshot of this hash's group for regeneration.
+        """
+        if self.group:
+            open(snapshot_marker(self.group), 'a').close()
+
     def save(self, *args, **kwargs):
         """
         Ensure that the date is updated
         """
+        created = self.pk is None
         self.date = datetime.datetime.utcnow()
+        self.update_version_key()
+        self.update_keywords()
+        self.render_feed()
         ValidatedDocument.save(self, *args, **kwargs)
-        self.notify_change('UPDATE')
+        self.mark_dirty()
+        GroupState.mark(self.group, updated=self.date)
+        self.move_counter(self.counter())
+        if not created:
+            # a new hash has nothing for clients to remove
+            self.notify_change('UPDATE')
 
     def delete(self, *args, **kwargs):
         """
         Update the removals collection when a document is deleted
         """
+        self.move_counter(None)
         ValidatedDocument.delete(self, *args, **kwargs)
+        self.mark_dirty()
+        GroupState.mark(self.group, updated=datetime.datetime.utcnow())
         self.notify_change()
 
 
-class Submission(JsonifyMixin, ValidatedDocument):
+class Submission(JsonifyMixin, CountedMixin, ValidatedDocument):
     """
     A Submission Hash
     """
-    meta = {'collection': 'submissions'}
+    meta = {
+        'collection': 'submissions',
+        'index_background': True,
+        'indexes': [
+            ('approval', 'group'),
+        ]
+    }
+
+    _counted_field = 'approval'
+    _counters = {'REQUESTED': 'submitted', 'PENDING_APPROVAL': 'pending'}
 
     submitter = StringField()
     submittedon = DateTimeField(default=datetime.datetime.utcnow)
@@ -506,12 +1089,126 @@ class Submission(JsonifyMixin, ValidatedDocument):
     def save(self, *args, **kwargs):
         self.pre_save_hook()
         ValidatedDocument.save(self, *args, **kwargs)
+        self.move_counter(self.counter())
 
     def delete(self, *args, **kwargs):
+        self.move_counter(None)
         self.remove_source_file(True, True)
         ValidatedDocument.delete(self, *args, **kwargs)
 
 
+# Models whose states are counted per group, see CountedMixin
+COUNTED_MODELS = [Hash, Submission]
+
+
+def recount():
+    """
+    Recount the documents in each counted state of every group, using one
+    aggregation per collection, and replace the GroupState counts with the
+    result. Every document is tagged with the counter it was counted in, see
+    CountedMixin.move_counter. Returns the counts keyed by group.
+    """
+    names = [
+        name for model in COUNTED_MODELS for name in model._counters.values()]
+    counts = dict(
+        (group, dict((name, 0) for name in names))
+        for group in SUBMISSION_GROUPS)
+
+    for model in COUNTED_MODELS:
+        field = model._counted_field
+        key = model._counted_key
+        collection = model._get_collection()
+        result = collection.aggregate([
+            {'$match': {field: {'$in': model._counters.keys()}}},
+            {'$group': {
+                '_id': {'group': '$group', 'state': '$%s' % (field)},
+                'count': {'$sum': 1}
+            }},
+        ])
+        for row in result['result']:
+            group = row['_id'].get('group')
+            state = row['_id']['state']
+            name = model._counters[state]
+            if group:
+                collection.update(
+                    {'group': group, field: state},
+                    {'$set': {key: [group, name]}}, multi=True)
+            if group in counts:
+                counts[group][name] += row['count']
+        collection.update(
+            {field: {'$nin': model._counters.keys()}},
+            {'$unset': {key: True}}, multi=True)
+
+    now = datetime.datetime.utcnow()
+    for (group, count) in counts.items():
+        GroupState.objects(group=group).update_one(
+            upsert=True, set__counts=count, set__counted=now, inc__version=1)
+    return counts
+
+
+def statistics():
+    """
+    The number of documents in each counted state keyed by group, as kept
+    up to date by CountedMixin. Recounts if a group was never counted.
+    """
+    states = dict(
+        (state.group, state) for state in
+        GroupState.objects(group__in=SUBMISSION_GROUPS.keys()))
+    for group in SUBMISSION_GROUPS:
+        if group not in states or states[group].counted is None:
+            return recount()
+
+    names = [
+        name for model in COUNTED_MODELS for name in model._counters.values()]
+    counts = {}
+    for (group, state) in states.items():
+        counts[group] = dict(
+            (name, state.counts.get(name, 0)) for name in names)
+    return counts
+
+
+class Job(Document):
+    """
+    A queued background task, see victims.web.handlers.queue.
+    """
+    meta = {
+        'collection': 'jobs',
+        'index_background': True,
+        'indexes': [
+            ('status', 'available'),
+            ('status', 'lease'),
+            {'fields': ['finished'], 'sparse': True,
+             'expireAfterSeconds': int(JOBS_RETENTION.total_seconds())},
+            # identical queued jobs are rejected, see queue.enqueue
+            {'fields': ['key'], 'unique': True, 'sparse': True},
+        ]
+    }
+
+    task = StringField(required=True)
+    # identifies the task and arguments while the job waits for its first run
+    key = StringField()
+    args = ListField(default=[])
+    kwargs = DictField(default={})
+    status = StringField(
+        choices=(
+            ('QUEUED', 'QUEUED'),
+            ('RUNNING', 'RUNNING'),
+            ('DONE', 'DONE'),
+            ('FAILED', 'FAILED')
+        ),
+        default='QUEUED'
+    )
+    attempts = IntField(default=0)
+    # the job can not be claimed before this time (backoff)
+    available = DateTimeField(default=datetime.datetime.utcnow)
+    # the worker running the job and until when it holds it
+    owner = StringField()
+    lease = DateTimeField()
+    error = StringField()
+    created = DateTimeField(default=datetime.datetime.utcnow)
+    finished = DateTimeField()
+
+
 class Plugin(Document):
     """
     A key value store for plugins
@@ -520,18 +1217,43 @@ class Plugin(Document):
 
     plugin = StringField(primary_key=True)
     config = DictField()
+    # incremented on every change of the config
+    version = IntField(default=0)
+
+    def _modify(self, update):
+        """
+        Atomically apply an update to the stored config. Returns False if the
+        config was changed elsewhere since this copy was loaded.
+        """
+        update['$inc'] = {'version': 1}
+        stored = self._get_collection().find_and_modify(
+            {'_id': self.pk}, update, upsert=True, new=True,
+            fields={'version': True})
+        current = stored['version'] == self.version + 1
+        self.version = stored['version']
+        return current
 
     def set(self, key, value):
-        self.config[key] = value
-        self.save()
+        return self.set_many({key: value})
+
+    def set_many(self, values):
+        """
+        Set several keys with a single $set.
+
+        :Parameters:
+           - `values`: The new values keyed by key.
+        """
+        self.config.update(values)
+        return self._modify({'$set': dict(
+            ('config.%s' % (key), value) for (key, value) in values.items())})
 
     def pop(self, key):
-        self.config.pop(key)
-        self.save()
+        self.config.pop(key, None)
+        return self._modify({'$unset': {'config.%s' % (key): True}})
 
     def get(self, key):
         return self.config.get(key, None)
 
 
 # All the models in the event something would like to grab them all
-MODELS = [Hash, Account, Submission]
+MODELS = [Hash, Removal, Account, Submission, Job]
@@ -14,7 +14,10 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from contextlib import contextmanager
+from time import time
 
+from victims.web import config
 from victims.web.models import Plugin
 
 
@@ -23,43 +26,100 @@ class PluginConfig(object):
     A plugin configuration object to wrap a persisted configuration in the DB.
 
     If a previous configuration exists for this plugin an empty one is created.
+    Reads are served from an in-process copy, which is reloaded once the
+    version of the stored configuration changes. Use `batch` to write several
+    keys at once.
     """
     def __init__(self, plugin):
-        self._config = Plugin.objects(plugin=plugin).first()
+        self._plugin = plugin
+        self._config = None
+        self._checked = 0
+        self._pending = None
+
+    def _load(self):
+        plugin = Plugin.objects(plugin=self._plugin).first()
+        if plugin is None:
+            Plugin._get_collection().update(
+                {'_id': self._plugin},
+                {'$setOnInsert': {'config': {}, 'version': 0}}, upsert=True)
+            plugin = Plugin.objects(plugin=self._plugin).first()
+        self._config = plugin
+        self._checked = time()
+
+    def snapshot(self):
+        """
+        The in-process copy of the stored configuration, reloaded if it was
+        changed elsewhere. Checked at most every PLUGIN_CONFIG_CHECK seconds.
+        """
         if self._config is None:
-            self._config = Plugin()
-            self._config.plugin = plugin
-            self._config.save()
+            self._load()
+        elif time() - self._checked >= config.PLUGIN_CONFIG_CHECK:
+            stored = Plugin._get_collection().find_one(
+                {'_id': self._plugin}, {'version': True})
+            if stored is None or \
+                    stored.get('version', 0) != self._config.version:
+                self._load()
+            else:
+                self._checked = time()
+        return self._config
 
     def __getattr__(self, attr):
-        try:
-            return object.__getattr__(self, attr)
-        except AttributeError:
-            return self._config.get(attr)
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self._pending and attr in self._pending:
+            return self._pending[attr]
+        return self.snapshot().get(attr)
 
     def __setattr__(self, attr, value):
-        if attr in self.__dict__ or '_config' not in self.__dict__:
-            # If this instance has this attr or _config not yet set
+        if attr.startswith('_'):
             object.__setattr__(self, attr, value)
+        elif self._pending is not None:
+            self._pending[attr] = value
         else:
-            self._config.set(attr, value)
+            self._write({attr: value})
+
+    def _write(self, values):
+        if not self.snapshot().set_many(values):
+            # changed elsewhere in the meantime
+            self._config = None
+
+    @contextmanager
+    def batch(self):
+        """
+        Buffer the assignments made within the block and write them with a
+        single $set once it exits. Nothing is written if the block raises.
+        """
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = {}
+        try:
+            yield self
+            pending = self._pending
+        finally:
+            self._pending = None
+        if pending:
+            self._write(pending)
 
     def keys(self):
-        return self._config.config.keys()
+        return self.snapshot().config.keys()
 
     def clear(self):
-        self._config.config = {}
-        self._config.save()
+        Plugin._get_collection().update(
+            {'_id': self._plugin},
+            {'$set': {'config': {}}, '$inc': {'version': 1}})
+        self._config = None
 
     def delete(self):
-        self._config.config = {}
-        self._config.delete()
+        self.snapshot().delete()
+        self._config = None
 
-    def pop(self):
-        self._config.pop()
+    def pop(self, key):
+        if not self.snapshot().pop(key):
+            self._config = None
 
     def reload(self):
-        self._config.reload()
+        self._load()
 
     def __repr__(self):
-        return str(self._config.config)
+        return str(self.snapshot().config)
@@ -20,86 +20,65 @@ Cross Talk plugin
 This plugin allows for different instances of the app to communicate.
 """
 
-from datetime import datetime, timedelta
+from time import time
 
-from flask import current_app
+from victims.web import config
+from victims.web.handlers.refresh import BackgroundRefresh
+from victims.web.models import GroupState, statistics
 
-from victims.web.config import SUBMISSION_GROUPS
-from victims.web.handlers.task import taskman
-from victims.web.models import Hash, Submission
-from victims.web.plugin import PluginConfig
 
-_CONFIG = PluginConfig('crosstalk')
-
-
-def update_front_page_stats():
-    stats = {}
-    stats['hashes'] = Hash.objects(status='RELEASED').only('group')
-    stats['submitted'] = Submission.objects(
-        approval='REQUESTED').only('group')
-    stats['pending'] = Submission.objects(
-        approval='PENDING_APPROVAL').only('group')
-
-    # Generate counts for objects and for each format
-    # data will contain hashes, hashes_jars, hashes_eggs etc.
-    groups = SUBMISSION_GROUPS.keys()
+def front_page_stats():
+    # counts are maintained as documents are saved, see CountedMixin
+    groups = config.SUBMISSION_GROUPS.keys()
     groups.sort()
-    data = {'groups': groups, 'stats': {}}
-    for group in groups:
-        stat = {}
-        for key in stats:
-            if group == 'all':
-                stat[key] = len(stats[key])
-            else:
-                stat[key] = len(stats[key].filter(group=group))
-        data['stats'][group] = stat
-    _CONFIG.front_page_stats = data
-
-
-class IndexPageMonitor():
-
-    def __init__(self):
-        self.refreshed_flag = False
-        self.refresh()
-
-    def refresh(self, blocking=False):
-        if blocking:
-            update_front_page_stats()
-        else:
-            taskman.add_task(update_front_page_stats)
-        self.refreshed_flag = True
-
-    def get_data(self):
-        _CONFIG.reload()
-        return _CONFIG.front_page_stats
+    return {'groups': groups, 'stats': statistics()}
 
 
-class SessionReaper():
-    DEFAULT_SESSION_REAP_PERIOD = timedelta(days=1)
+class IndexPageMonitor(BackgroundRefresh):
+    """
+    In-process cache of the front page statistics. Once loaded, these are
+    served as is while a background thread revalidates them against the
+    version stamp of the counts, which other instances update.
+    """
+    name = 'front page stats'
 
     def __init__(self):
-        self.last_reap = _CONFIG.sessions_last_reap
-        if not self.last_reap:
-            self.last_reap = datetime.utcnow()
+        BackgroundRefresh.__init__(self)
+        self.data = None
+        self.version = None
 
     @property
-    def last_reap(self):
-        return _CONFIG.sessions_last_reap
+    def interval(self):
+        return config.FRONT_PAGE_STATS_CHECK
+
+    def refresh(self):
+        """
+        Revalidate the statistics on the next request.
+        """
+        self.checked = 0
+
+    def revalidate(self):
+        """
+        Reload the statistics if their version stamp changed.
+        """
+        version = GroupState.stamp()
+        if self.data is None or version != self.version:
+            data = front_page_stats()
+            with self._lock:
+                self.data = data
+                self.version = version
 
-    @last_reap.setter
-    def last_reap(self, value):
-        _CONFIG.sessions_last_reap = value
-
-    def reap(self):
-        window = current_app.config.get(
-            'SESSION_REAP_PERIOD', self.DEFAULT_SESSION_REAP_PERIOD)
-        if self.last_reap is None \
-                or datetime.utcnow() - self.last_reap > window:
-            current_app.session_interface.cls.objects(
-                expiration__lt=datetime.utcnow()
-            ).delete()
-            self.last_reap = datetime.utcnow()
+    def get_data(self):
+        """
+        The front page statistics. Only the first call waits for them to be
+        loaded, later calls may return stale data while revalidating.
+        """
+        if self.data is None:
+            self.revalidate()
+            self.checked = time()
+        else:
+            self.schedule()
+        return self.data
 
 
 indexmon = IndexPageMonitor()
-session_reaper = SessionReaper()
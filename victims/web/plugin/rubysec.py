@@ -78,7 +78,7 @@ class RubySecDatabase():
             self.repository.clone()
 
     def update(self):
-        previous = _CONFIG.get.prev_head
+        previous = _CONFIG.prev_head
         files = []
         self.repository.pull()
         files = self.repository.files_changed(
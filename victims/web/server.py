@@ -0,0 +1,89 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Production server. Runs the application in a pool of pre-forked gunicorn
+workers, as configured by the SERVER_* settings.
+
+Sending HUP to the master process reloads the configuration and gracefully
+replaces the workers, each of which loads the application (and hence any
+updated code) afresh.
+"""
+from gunicorn.app.base import BaseApplication
+
+from victims.web import config
+
+try:
+    import gevent
+except ImportError:
+    # only required for the gevent worker classes
+    gevent = None
+
+
+def server_options():
+    """
+    The gunicorn settings derived from the application configuration.
+    """
+    return {
+        'bind': '%s:%d' % (config.FLASK_HOST, config.FLASK_PORT),
+        'workers': config.SERVER_WORKERS,
+        'worker_class': config.SERVER_WORKER_CLASS,
+        'worker_connections': config.SERVER_WORKER_CONNECTIONS,
+        'timeout': config.SERVER_TIMEOUT,
+        'graceful_timeout': config.SERVER_GRACEFUL_TIMEOUT,
+        'keepalive': config.SERVER_KEEPALIVE,
+        'max_requests': config.SERVER_MAX_REQUESTS,
+        'pidfile': config.SERVER_PIDFILE,
+        # every worker imports the application itself, so that a reload
+        # picks up new code
+        'preload_app': False,
+    }
+
+
+class VictimsServer(BaseApplication):
+    """
+    Gunicorn application serving victims.web.application.app.
+    """
+
+    def __init__(self, options=None):
+        """
+        :Parameters:
+           - `options`: gunicorn settings overriding server_options().
+        """
+        self.options = server_options()
+        self.options.update(options or {})
+        worker_class = self.options['worker_class']
+        if worker_class.startswith('gevent') and gevent is None:
+            raise ImportError(
+                'The %s worker class requires gevent to be installed' % (
+                    worker_class))
+        super(VictimsServer, self).__init__()
+
+    def load_config(self):
+        for (key, value) in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from victims.web.application import app
+        return app
+
+
+def serve(options=None):
+    """
+    Run the production server until it is stopped.
+    """
+    VictimsServer(options).run()
@@ -0,0 +1,157 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Snapshot module. Pre-built per group dumps of the hashes collection.
+
+A snapshot is a gzip compressed file with one JSON record (using the default
+update fields) per line. The modification time of the file is set to the time
+the snapshot was started, so that clients can catch up using the update and
+remove feeds from that point onwards.
+"""
+import gzip
+from datetime import datetime
+from errno import EEXIST
+from time import time
+
+from os import O_CREAT, O_EXCL, O_WRONLY, close, getpid, open as os_open, \
+    remove, rename, utime
+from os.path import getmtime, getsize, isfile, join
+
+from victims.web import config
+from victims.web.handlers.task import task
+from victims.web.models import Hash, snapshot_marker
+
+# A generation lock older than this (in seconds) is considered abandoned
+LOCK_TIMEOUT = 60 * 60
+
+
+def snapshot_path(group):
+    """
+    Path of the snapshot file for a given group.
+    """
+    return join(config.SNAPSHOT_FOLDER, '%s.json.gz' % (group))
+
+
+def _lock_path(group):
+    return join(config.SNAPSHOT_FOLDER, '%s.lock' % (group))
+
+
+def is_dirty(group):
+    """
+    Returns True if the snapshot for the group is missing or out of date.
+    """
+    return isfile(snapshot_marker(group)) or not isfile(snapshot_path(group))
+
+
+def is_generating(group):
+    """
+    Returns True if a snapshot for the group is currently being generated.
+    """
+    return isfile(_lock_path(group))
+
+
+def snapshot_date(group):
+    """
+    The utc datetime at which the current snapshot was started, None if no
+    snapshot is available.
+    """
+    path = snapshot_path(group)
+    if not isfile(path):
+        return None
+    return datetime.utcfromtimestamp(int(getmtime(path)))
+
+
+def snapshot_etag(group):
+    """
+    An entity tag identifying the current snapshot of a group.
+    """
+    path = snapshot_path(group)
+    return '%s-%d-%d' % (group, int(getmtime(path)), getsize(path))
+
+
+def _acquire(group):
+    """
+    Take the generation lock of a group. Returns False if another process
+    is already generating the snapshot.
+    """
+    path = _lock_path(group)
+    try:
+        close(os_open(path, O_CREAT | O_EXCL | O_WRONLY))
+        return True
+    except OSError as e:
+        if e.errno != EEXIST:
+            raise
+    if time() - getmtime(path) > LOCK_TIMEOUT:
+        config.LOGGER.warn('Removing stale snapshot lock %s' % (path))
+        remove(path)
+        return _acquire(group)
+    return False
+
+
+def _release(group):
+    path = _lock_path(group)
+    if isfile(path):
+        remove(path)
+
+
+def generate(group):
+    """
+    (Re)generates the snapshot for the given group. The new snapshot replaces
+    the previous one atomically once it has been written out completely.
+
+    Returns False if a snapshot generation was already in progress.
+    """
+    if not _acquire(group):
+        return False
+
+    path = snapshot_path(group)
+    tmp = '%s.%d.tmp' % (path, getpid())
+    marker = snapshot_marker(group)
+    try:
+        # any change from here on will flag the snapshot dirty again
+        if isfile(marker):
+            remove(marker)
+        started = int(time())
+
+        items = Hash.rendered(
+            Hash.objects(group=group), config.API_UPDATES_DEFAULT_FIELDS)
+        out = gzip.open(tmp, 'wb')
+        try:
+            for data in items:
+                if data != '{}':
+                    out.write(data + '\n')
+        finally:
+            out.close()
+
+        utime(tmp, (started, started))
+        rename(tmp, path)
+    except:
+        open(marker, 'a').close()
+        if isfile(tmp):
+            remove(tmp)
+        raise
+    finally:
+        _release(group)
+    return True
+
+
+@task
+def refresh(group):
+    """
+    Regenerate the snapshot of a group in the background.
+    """
+    generate(group)
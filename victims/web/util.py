@@ -1,13 +1,19 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from calendar import timegm
 from copy import deepcopy
-from json import loads
+from datetime import datetime, timedelta
+from json import dumps, loads
 from subprocess import check_output, CalledProcessError
 from urlparse import urlparse, urljoin
 
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
 from flask import request, flash
 from os.path import isfile
 
 from victims.web import config
 from victims.web.handlers.task import task
+from victims.web.keywords import terms
 from victims.web.models import Hash, Submission
 
 
@@ -43,8 +49,9 @@ def hash_submission(submission_id):
         return
 
     if not isfile(submission.source):
+        # fail rather than succeed, so that a queued job is retried
         submission.add_comment('Source file not found.')
-        return
+        raise IOError('Source file %s not found' % (submission.source))
 
     if submission.group not in config.HASHING_COMMANDS:
         submission.add_comment('Hashing command for this group not found.')
@@ -90,6 +97,7 @@ def hash_submission(submission_id):
     except Exception as e:
         submission.add_comment(e)
         config.LOGGER.warn('Failed to hash: ' + e.message)
+        raise
 
 
 def set_hash(submission):
@@ -100,6 +108,83 @@ def set_hash(submission):
     hash_submission(sid)
 
 
+def to_millis(date):
+    """
+    Convert a datetime into milliseconds since epoch, the precision used by
+    MongoDB.
+    """
+    return timegm(date.utctimetuple()) * 1000 + date.microsecond // 1000
+
+
+def from_millis(millis):
+    """
+    Convert milliseconds since epoch into a utc datetime.
+    """
+    return datetime.utcfromtimestamp(0) + timedelta(milliseconds=int(millis))
+
+
+def encode_cursor(*values):
+    """
+    Encode the given values into an opaque url-safe continuation token.
+    """
+    return urlsafe_b64encode(dumps(values))
+
+
+def decode_cursor(token):
+    """
+    Decode a continuation token created by `encode_cursor`. A ValueError is
+    raised if the token is not valid.
+    """
+    try:
+        values = loads(urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def search(query, groups=None, cursor=None, limit=None, fields=None):
+    """
+    A page of the released hashes matching all terms of a search query.
+
+    :Parameters:
+       - `query`: The search query, see victims.web.keywords.terms.
+       - `groups`: The groups to restrict the search to.
+       - `cursor`: A continuation token as returned by a previous call.
+       - `limit`: The maximum number of hashes in the page.
+       - `fields`: The fields to load, all if None.
+
+    Returns a tuple of the page (as a list) and the continuation token for the
+    next page. The token is None if no more hashes match.
+    """
+    if limit is None:
+        limit = config.SEARCH_PAGE_SIZE
+    elif limit < 1 or limit > config.SEARCH_PAGE_LIMIT:
+        raise ValueError('Invalid limit')
+
+    found = terms(query)
+    if len(found) == 0:
+        return ([], None)
+
+    items = Hash.search(found, groups)
+    if cursor is not None:
+        try:
+            (last_id, ) = decode_cursor(cursor)
+            items = items.filter(id__gt=ObjectId(str(last_id)))
+        except (InvalidId, TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+    if fields is not None:
+        items = items.only(*fields)
+
+    page = list(items.limit(limit + 1))
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(str(page[-1].id))
+    return (page, next_cursor)
+
+
 def safe_redirect_url():
     """
     Returns request.args['next'] if the url is safe, else returns none.
@@ -0,0 +1,200 @@
+# This file is part of victims-web.
+#
+# Copyright (C) 2013 The Victims Project
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Version ordering for the supported groups.
+
+Versions are converted into keys that sort (as plain strings) in the order
+defined by the versioning scheme of the group. Keys are stored alongside the
+hashes so that version ranges can be resolved by MongoDB as index range
+scans.
+
+A key is a sequence of tokens, each starting with a rank character followed
+by a self delimiting payload:
+
+- numbers are their digit count (two digits) followed by the digits
+- strings are lower case alphanumerics terminated by '!'
+- the end of a version is a lone rank character
+
+As rank characters are digits (which sort after '!'), comparing two keys
+compares their tokens in order.
+"""
+import re
+
+from victims.web import config
+
+_NUMBER_RE = re.compile('^[0-9]+$')
+_TOKEN_RE = re.compile('[0-9]+|[a-zA-Z]+')
+
+
+def _number(value):
+    value = str(int(value))
+    return '%02d%s' % (len(value), value)
+
+
+def _string(value):
+    return '%s!' % (re.sub('[^a-z0-9]', '', value.lower()))
+
+
+def _trim(tokens, zero):
+    """
+    Drop zeros directly preceding a non numeric token or the end.
+    """
+    trimmed = []
+    for token in tokens:
+        if not isinstance(token, int):
+            while trimmed and trimmed[-1] == zero:
+                trimmed.pop()
+        trimmed.append(token)
+    while trimmed and trimmed[-1] == zero:
+        trimmed.pop()
+    return trimmed
+
+
+# Maven (ComparableVersion) ordering:
+# alpha < beta < milestone < rc < snapshot < release < sp < other < number
+_MAVEN_QUALIFIERS = ['alpha', 'beta', 'milestone', 'rc', 'snapshot']
+_MAVEN_ALIASES = {
+    'a': 'alpha', 'b': 'beta', 'm': 'milestone', 'cr': 'rc',
+    'ga': '', 'final': '', 'release': '',
+}
+
+
+def maven_key(version):
+    """
+    Sortable key of a Maven version.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(version):
+        if _NUMBER_RE.match(token):
+            tokens.append(int(token))
+        else:
+            tokens.append(_MAVEN_ALIASES.get(token.lower(), token.lower()))
+    tokens = [token for token in _trim(tokens, 0) if token != '']
+
+    key = ''
+    for token in tokens:
+        if isinstance(token, int):
+            key += '5' + _number(token)
+        elif token in _MAVEN_QUALIFIERS:
+            key += '1' + str(_MAVEN_QUALIFIERS.index(token))
+        elif token == 'sp':
+            key += '3'
+        else:
+            key += '4' + _string(token)
+    return key + '2'
+
+
+# RubyGems (Gem::Version) ordering: prerelease string < end < number
+def rubygems_key(version):
+    """
+    Sortable key of a RubyGems version.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(version):
+        if _NUMBER_RE.match(token):
+            tokens.append(int(token))
+        else:
+            tokens.append(token.lower())
+
+    key = ''
+    for token in _trim(tokens, 0):
+        if isinstance(token, int):
+            key += '3' + _number(token)
+        else:
+            key += '1' + _string(token)
+    return key + '2'
+
+
+# PEP 440 ordering: dev < pre (a < b < rc) < release < post
+_PEP440_RE = re.compile(
+    r'^v?(?:(?P<epoch>[0-9]+)!)?'
+    r'(?P<release>[0-9]+(?:\.[0-9]+)*)'
+    r'(?:[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)'
+    r'[-_.]?(?P<pre_n>[0-9]+)?)?'
+    r'(?:-(?P<post_n1>[0-9]+)|[-_.]?(?P<post_l>post|rev|r)'
+    r'[-_.]?(?P<post_n2>[0-9]+)?)?'
+    r'(?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>[0-9]+)?)?'
+    r'(?:\+[a-z0-9]+(?:[-_.][a-z0-9]+)*)?$'
+)
+_PEP440_PRE = {
+    'a': 'a', 'alpha': 'a', 'b': 'b', 'beta': 'b',
+    'c': 'c', 'rc': 'c', 'pre': 'c', 'preview': 'c',
+}
+
+
+def pep440_key(version):
+    """
+    Sortable key of a PEP 440 version. Local version labels are ignored.
+    """
+    match = _PEP440_RE.match(version.strip().lower())
+    if match is None:
+        raise ValueError('Invalid PEP 440 version %s' % (version))
+
+    release = _trim([int(n) for n in match.group('release').split('.')], 0)
+    key = _number(match.group('epoch') or 0)
+    key += ''.join('.' + _number(n) for n in release) + '-'
+
+    pre = match.group('pre_l')
+    post = match.group('post_l') or match.group('post_n1')
+    dev = match.group('dev_l')
+    if pre:
+        key += '1' + _PEP440_PRE[pre] + _number(match.group('pre_n') or 0)
+    elif dev and not post:
+        key += '0'
+    else:
+        key += '2'
+
+    if post:
+        key += '1' + _number(
+            match.group('post_n1') or match.group('post_n2') or 0)
+    else:
+        key += '0'
+
+    if dev:
+        key += '0' + _number(match.group('dev_n') or 0)
+    else:
+        key += '1'
+    return key
+
+
+SCHEMES = {
+    'maven': maven_key,
+    'pep440': pep440_key,
+    'rubygems': rubygems_key,
+}
+
+
+def version_key(group, version):
+    """
+    Returns the sortable key of a version as per the versioning scheme of the
+    given group. None is returned if the group has no scheme configured.
+
+    :Parameters:
+       - `group`: The group the version belongs to.
+       - `version`: The version string.
+    """
+    scheme = config.VERSION_SCHEMES.get(group)
+    if scheme is None or version is None:
+        return None
+    return SCHEMES[scheme](version)
+
+
+def compare(group, a, b):
+    """
+    Compare two versions of a group, returns -1, 0 or 1 like cmp.
+    """
+    return cmp(version_key(group, a), version_key(group, b))